@@ -2,9 +2,19 @@ from typing import TypedDict, Literal, Optional, List
 from langgraph.graph import StateGraph, END
 import dateparser
 import re
+import threading
 from datetime import datetime, timedelta
-from gcal import check_availability, create_event
+from gcal import (
+    check_slot, fetch_busy_intervals,
+    cache_availability, cached_availability, deadline_passed,
+    CalendarUnavailable, DeadlineExceeded
+)
+from availability import AvailabilityGrid
+from zoneinfo import ZoneInfo
 from datetime import time
+from replies import render, format_datetime, suggestion_reply
+from checkpoints import open_checkpointer
+from outbox import open_outbox
 
 # Define the state schema
 class AgentState(TypedDict):
@@ -17,6 +27,12 @@ class AgentState(TypedDict):
     suggested_slots: Optional[List[datetime]]  # Track what we suggested
     conversation_state: str  # Track conversation flow
     guest_email: Optional[str] 
+    locale: Optional[str]  # Reply language, defaults to English
+    calendar_degraded: bool  # Availability could not be confirmed with Google
+    session_id: Optional[str]  # Chat session, used to report back confirmed bookings
+    booking_id: Optional[int]  # Outbox row of the latest booking
+    booking_link: Optional[str]  # Calendar link once the booking is confirmed
+    booking_status: Optional[str]  # 'pending', 'confirmed' or 'failed' (not yet told to the user)
 
 # --- Define your node functions ---
 
@@ -94,19 +110,43 @@ def parse_time_manually(text):
     except ValueError:
         return None
 
+CALENDAR_TZ = ZoneInfo("Africa/Cairo")
+
 def find_available_slots(date: datetime.date, duration_minutes=30) -> list[datetime]:
     """
     Return a list of available start times on a given date.
     """
-    slots = []
     work_hours_start = 9
     work_hours_end = 18
+    candidates = [
+        datetime.combine(date, time(hour=hour, minute=0))
+        for hour in range(work_hours_start, work_hours_end)
+    ]
+
+    # One freebusy query for the whole day instead of one per slot
+    day_start = datetime.combine(date, time(0), tzinfo=CALENDAR_TZ)
+    day_end = day_start + timedelta(days=1)
+    try:
+        intervals = fetch_busy_intervals(["primary"], day_start, day_end)
+    except CalendarUnavailable:
+        # Degraded mode: only offer slots we already know are free
+        return [
+            start_dt for start_dt in candidates
+            if cached_availability(start_dt, start_dt + timedelta(minutes=duration_minutes))
+        ]
 
-    for hour in range(work_hours_start, work_hours_end):
-        start_dt = datetime.combine(date, time(hour=hour, minute=0))
-        end_dt = start_dt + timedelta(minutes=duration_minutes)
+    grid = AvailabilityGrid.from_intervals(intervals, day_start, day_end)
+    free = grid.all_free() & grid.working_hours(work_hours_start, work_hours_end)
+    free_starts = {
+        start.replace(tzinfo=None)
+        for start in grid.find_runs(free, duration_minutes, step_minutes=60)
+    }
 
-        if check_availability(start_dt, end_dt):
+    slots = []
+    for start_dt in candidates:
+        available = start_dt in free_starts
+        cache_availability(start_dt, start_dt + timedelta(minutes=duration_minutes), available)
+        if available:
             slots.append(start_dt)
 
     return slots
@@ -209,7 +249,7 @@ def parse_message(state: AgentState) -> AgentState:
         else:
             return {
                 **state,
-                "reply": "Hmm, that doesn't look like a valid email. Please type your email address.",
+                "reply": render("bad_email", state.get("locale")),
                 "conversation_state": "awaiting_email"
             }
     
@@ -322,6 +362,13 @@ def parse_message(state: AgentState) -> AgentState:
                 "conversation_state": "initial"
             }
     
+    elif intent == "reject_suggestion":
+        # Let the router send this to handle_rejection
+        return {
+            **state,
+            "intent": "reject_suggestion"
+        }
+    
     else:
         return {
             **state,
@@ -334,10 +381,21 @@ def check_calendar(state: AgentState) -> AgentState:
         start_time = state["proposed_start"]
         end_time = state["proposed_end"]
         
-        available = check_availability(start_time, end_time)
+        try:
+            available, from_cache = check_slot(start_time, end_time)
+        except CalendarUnavailable as e:
+            # Degraded mode: take the request and confirm it once Google is back
+            print(f"Calendar unavailable, continuing in degraded mode: {e}")
+            return {
+                **state,
+                "available": True,
+                "calendar_degraded": True
+            }
+        # A cached "free" is only a guess; the outbox checks the slot again before booking
         return {
             **state,
-            "available": available
+            "available": available,
+            "calendar_degraded": from_cache
         }
     return state
 
@@ -345,29 +403,44 @@ def book_meeting(state: AgentState) -> AgentState:
     if not state.get("guest_email"):
         return {
             **state,
-            "reply": "Great! Before I book this meeting, could you please provide your email so I can add it to the calendar invite?",
+            "reply": render("ask_email", state.get("locale")),
             "conversation_state": "awaiting_email"
         }
     if state.get("available"):
         start_time = state["proposed_start"]
         end_time = state["proposed_end"]
         
-        link = create_event(
+        # The user was already told this turn timed out; don't book behind their back
+        if deadline_passed():
+            raise DeadlineExceeded("Request deadline passed before booking")
+
+        # The outbox worker creates the event; answer without waiting for Google
+        booking_id = outbox.enqueue(
             start_time,
             end_time,
             summary="Meeting Is Booked with AI Bot",
-            guest_email=state.get("guest_email")
+            guest_email=state.get("guest_email"),
+            session_id=state.get("session_id"),
+            degraded=bool(state.get("calendar_degraded"))
         )
         
         return {
             **state,
-            "reply": f"✅ Your meeting is booked for {start_time.strftime('%Y-%m-%d %H:%M')}. Here's the link: {link}",
+            "reply": render(
+                "booking_queued" if state.get("calendar_degraded") else "booking_provisional",
+                state.get("locale"),
+                when=format_datetime(start_time, state.get("locale")),
+                email=state.get("guest_email"),
+            ),
+            "booking_id": booking_id,
+            "booking_link": None,
+            "booking_status": "pending",
             "conversation_state": "completed"
         }
     else:
         return {
             **state,
-            "reply": "Sorry, that time slot is busy. Please suggest another time.",
+            "reply": render("slot_busy", state.get("locale")),
             "conversation_state": "initial"
         }
 
@@ -384,7 +457,7 @@ def collect_email(state: AgentState) -> AgentState:
     else:
         return {
             **state,
-            "reply": "Hmm, that doesn't look like a valid email. Please type your email address.",
+            "reply": render("bad_email", state.get("locale")),
             "conversation_state": "awaiting_email"
         }
 
@@ -392,7 +465,7 @@ def handle_rejection(state: AgentState) -> AgentState:
     """Handle when user rejects our suggestions"""
     return {
         **state,
-        "reply": "No problem! Please suggest another time that works for you (e.g., 'tomorrow at 2pm' or 'Friday at 10am').",
+        "reply": render("rejection", state.get("locale")),
         "conversation_state": "initial",
         "suggested_slots": None  # Clear previous suggestions
     }
@@ -407,10 +480,7 @@ def suggest_alternatives(state: AgentState) -> AgentState:
         if free_slots:
             # Store suggestions in state for later reference
             suggested_slots = free_slots[:3]  # Keep top 3 suggestions
-            times_str = ", ".join(
-                slot.strftime("%H:%M") for slot in suggested_slots
-            )
-            reply = f"Sorry, that time slot is busy. But I'm free at these times on {date}: {times_str}. Would you like one of those?"
+            reply = suggestion_reply(date, tuple(suggested_slots), state.get("locale"))
             
             return {
                 **state,
@@ -421,42 +491,40 @@ def suggest_alternatives(state: AgentState) -> AgentState:
         else:
             return {
                 **state,
-                "reply": f"Sorry, that time slot is busy and I found no other free times on {date}. Please suggest another day or time.",
+                "reply": suggestion_reply(date, (), state.get("locale")),
                 "conversation_state": "initial"
             }
     else:
         return {
             **state,
-            "reply": "Sorry, that time slot is busy. Please suggest another time.",
+            "reply": render("slot_busy", state.get("locale")),
             "conversation_state": "initial"
         }
 
+# Day words that mean the user tried to give a time, compiled once
+DAY_WORDS_RE = re.compile(
+    r"tomorrow|today|next week|monday|tuesday|wednesday|thursday|friday|saturday|sunday"
+)
+
+GREETINGS = frozenset(["hi", "hello", "hey"])
+
 def fallback(state: AgentState) -> AgentState:
-    message = state.get("message", "")
     intent = state.get("intent", "")
+    locale = state.get("locale")
     message = state.get("message", "").strip().lower()
-    if message in ["hi", "hello", "hey"]:
+    if message in GREETINGS:
         return {
             **state,
-            "reply": "Hi there! When would you like to book your appointment?",
+            "reply": render("greeting", locale),
             "conversation_state": "initial"
         }
     if intent == "unknown":
-        if any(word in message.lower() for word in [
-            "tomorrow", "today", "next week",
-            "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"
-        ]):
-            reply = (
-                f"I detected time-related words in '{message}' but couldn't parse the exact time. "
-                "Please try formats like 'tomorrow at 3pm' or 'next Monday at 2:30pm'."
-            )
+        if DAY_WORDS_RE.search(message):
+            reply = render("unparsed_time", locale, message=message)
         else:
-            reply = (
-                "I couldn't find any time information in your message. "
-                "Please try something like 'book me a call tomorrow at 3pm'."
-            )
+            reply = render("no_time", locale)
     else:
-        reply = "I'm not sure how to help with that. Please try booking a meeting with a specific time."
+        reply = render("not_sure", locale)
 
     return {
         **state,
@@ -514,17 +582,103 @@ workflow.add_edge("collect_email", END)
 # Compile the graph
 app = workflow.compile()
 
+# Same graph with SQLite-backed checkpoints, one thread per chat session
+checkpointer = open_checkpointer()
+persistent_app = workflow.compile(checkpointer=checkpointer)
+
+# Bookings waiting to be written to Google Calendar
+outbox = open_outbox()
+
+# Turns and outbox callbacks for the same session read and write its checkpoint
+# under one of these locks, so neither overwrites the other's update
+SESSION_LOCKS = [threading.Lock() for _ in range(64)]
+
+def session_lock(user_id: str) -> threading.Lock:
+    return SESSION_LOCKS[hash(user_id) % len(SESSION_LOCKS)]
+
+# --- Fast paths for trivial turns ---
+
+REJECTIONS = frozenset(["no", "none", "nope", "no thanks", "different", "other"])
+
+# Conversation states where parse_message does nothing special before classify_intent
+FAST_PATH_STATES = ("initial", "checking", "booking", "awaiting_choice", "completed")
+
+def build_fast_path_table() -> dict:
+    """
+    Precompute (conversation_state, normalized message) -> (intent, reply key, state updates)
+    for turns whose reply is fixed. Entries are only added when classify_intent agrees,
+    so the table can never answer differently from the graph.
+    """
+    table = {}
+    for conversation_state in FAST_PATH_STATES:
+        for phrase in GREETINGS:
+            if classify_intent(phrase, conversation_state) == "unknown":
+                table[(conversation_state, phrase)] = ("unknown", "greeting", {})
+        for phrase in REJECTIONS:
+            if classify_intent(phrase, conversation_state) == "reject_suggestion":
+                table[(conversation_state, phrase)] = (
+                    "reject_suggestion", "rejection", {"suggested_slots": None}
+                )
+    return table
+
+FAST_PATH_TABLE = build_fast_path_table()
+
+def fast_path(state: AgentState) -> Optional[AgentState]:
+    """
+    Answer turns that need no calendar access without invoking the graph.
+    Returns None when the turn has to go through `app`.
+    """
+    conversation_state = state.get("conversation_state", "initial")
+    if conversation_state not in FAST_PATH_STATES:
+        return None
+
+    # Fixed replies straight from the lookup table
+    entry = FAST_PATH_TABLE.get((conversation_state, state["message"].strip().lower()))
+    if entry:
+        intent, reply_key, updates = entry
+        return {
+            **state,
+            **updates,
+            "intent": intent,
+            "reply": render(reply_key, state.get("locale")),
+            "conversation_state": "initial"
+        }
+
+    # No booking intent: run the parse node alone and finish with the routed node
+    if classify_intent(state["message"], conversation_state) in ("unknown", "reject_suggestion"):
+        parsed = parse_message(state)
+        route = route_after_parse(parsed)
+        if route == "fallback":
+            return fallback(parsed)
+        if route == "handle_rejection":
+            return handle_rejection(parsed)
+
+    return None
+
+def run_turn(initial_state: AgentState) -> AgentState:
+    """Run one turn, skipping the graph when a fast path applies"""
+    result = fast_path(initial_state)
+    if result is None:
+        result = app.invoke(initial_state)
+    return result
+
 # --- Exposed functions for FastAPI ---
 
-# Global state storage (in production, use proper session management)
-conversation_states = {}
+def thread_config(user_id: str) -> dict:
+    """Map a chat session id to its checkpoint thread"""
+    return {"configurable": {"thread_id": user_id}}
 
 def handle_message(message: str, user_id: str = "default") -> str:
     """
     Handle a message and return reply, automatically managing conversation state
     """
-    # Get previous state for this user
-    previous_state = conversation_states.get(user_id)
+    config = thread_config(user_id)
+    with session_lock(user_id):
+        return run_session_turn(message, user_id, config)
+
+def run_session_turn(message: str, user_id: str, config: dict) -> str:
+    # Get previous state for this user from the latest checkpoint
+    previous_state = persistent_app.get_state(config).values
     
     # Initialize state with previous conversation context
     if previous_state:
@@ -537,15 +691,61 @@ def handle_message(message: str, user_id: str = "default") -> str:
             "message": message,
             "conversation_state": "initial"
         }
+    initial_state["session_id"] = user_id
+
+    # Tell the user once if their last booking could not be created
+    failure_notice = None
+    if previous_state.get("booking_status") == "failed":
+        booking = outbox.get(previous_state["booking_id"])
+        # The outbox row may be gone; fall back to the time the session asked for
+        start_time = booking["start_time"] if booking else previous_state.get("proposed_start")
+        if start_time:
+            failure_notice = render(
+                "booking_failed",
+                previous_state.get("locale"),
+                when=format_datetime(start_time, previous_state.get("locale")),
+            )
+        else:
+            failure_notice = render("booking_failed_unknown", previous_state.get("locale"))
+        initial_state["booking_id"] = None
+        initial_state["booking_status"] = None
     
-    result = app.invoke(initial_state)
+    # A turn's checkpoints are committed together, or not at all if it raises
+    with checkpointer.turn():
+        result = fast_path(initial_state)
+        if result is None:
+            result = persistent_app.invoke(initial_state, config, durability="exit")
+        else:
+            # Record fast-path turns as if the routed node had produced them
+            persistent_app.update_state(config, result, as_node=route_after_parse(result))
+        # Past the deadline the user got a "timed out" reply, so keep the old state,
+        # unless a booking was already queued and the state must point at it
+        if deadline_passed() and result.get("booking_id") == initial_state.get("booking_id"):
+            raise DeadlineExceeded("Request deadline passed before the turn finished")
     reply = result.get("reply", "Something went wrong.")
-    
-    # Store updated state for this user
-    conversation_states[user_id] = result
+    if failure_notice:
+        reply = f"{failure_notice}\n\n{reply}"
     
     return reply
 
+def record_booking_outcome(user_id: str, booking_id: int, update: dict) -> None:
+    """Store what became of a queued booking on the user's session"""
+    config = thread_config(user_id)
+    with session_lock(user_id), checkpointer.turn():
+        state = persistent_app.get_state(config).values
+        # The user may have booked again since; only the latest booking is tracked
+        if state.get("booking_id") != booking_id:
+            return
+        persistent_app.update_state(config, update, as_node="book")
+
+def record_booking_link(user_id: str, booking_id: int, link: str) -> None:
+    """Outbox callback for a created event"""
+    record_booking_outcome(user_id, booking_id, {"booking_link": link, "booking_status": "confirmed"})
+
+def record_booking_failure(user_id: str, booking_id: int, error: str) -> None:
+    """Outbox callback for a dead-lettered booking; the user hears about it on their next turn"""
+    record_booking_outcome(user_id, booking_id, {"booking_status": "failed"})
+
 def handle_message_with_state(message: str, previous_state: dict = None) -> tuple[str, dict]:
     """
     Alternative function that returns both reply and state for advanced usage
@@ -562,7 +762,7 @@ def handle_message_with_state(message: str, previous_state: dict = None) -> tupl
             "conversation_state": "initial"
         }
     
-    result = app.invoke(initial_state)
+    result = run_turn(initial_state)
     reply = result.get("reply", "Something went wrong.")
     
     # Return both reply and state for conversation continuity
@@ -570,4 +770,5 @@ def handle_message_with_state(message: str, previous_state: dict = None) -> tupl
 
 def clear_conversation(user_id: str = "default") -> None:
     """Clear conversation state for a user"""
-    conversation_states.pop(user_id, None)
+    with session_lock(user_id):
+        checkpointer.delete_thread(user_id)
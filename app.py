@@ -4,15 +4,78 @@ import streamlit as st
 import requests
 import subprocess
 import os
+import json
+import time
+import uuid
+from requests.adapters import HTTPAdapter
 
-# FastAPI URL
-API_URL = "https://tailortalk-internship-production.up.railway.app/chat"
+# FastAPI URL (override with BACKEND_URL to point at a local stub, e.g. http://localhost:8000)
+BACKEND_URL = os.environ.get(
+    "BACKEND_URL", "https://tailortalk-internship-production.up.railway.app"
+).rstrip("/")
+STREAM_URL = f"{BACKEND_URL}/chat/stream"
+CHAT_URL = f"{BACKEND_URL}/chat"
+REQUEST_TIMEOUT = float(os.environ.get("BACKEND_TIMEOUT", "20"))
+
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """Keep-alive HTTP session shared across reruns so we don't reconnect every turn"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def stream_reply(session_id: str, message: str, timings: dict, status):
+    """
+    Send a message to the backend and yield the reply text once it arrives.
+    Progress events are shown in the `status` placeholder meanwhile.
+    Fills `timings` with time-to-first-byte and total latency in milliseconds.
+    """
+    payload = {"message": message, "session_id": session_id}
+    session = get_http_session()
+    started = time.perf_counter()
+    response = session.post(STREAM_URL, json=payload, timeout=REQUEST_TIMEOUT, stream=True)
+    try:
+        # Older backends have no /chat/stream, use the plain JSON endpoint
+        if response.status_code in (404, 405):
+            response.close()
+            response = session.post(CHAT_URL, json=payload, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            timings["first_byte_ms"] = (time.perf_counter() - started) * 1000
+            yield response.json().get("reply", "Sorry, I didn't understand that.")
+        else:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                if "first_byte_ms" not in timings:
+                    timings["first_byte_ms"] = (time.perf_counter() - started) * 1000
+                event = json.loads(line)
+                if "progress" in event:
+                    status.caption(event["progress"])
+                elif "reply" in event:
+                    status.empty()
+                    yield event["reply"]
+    finally:
+        response.close()
+
+    timings["total_ms"] = (time.perf_counter() - started) * 1000
 
 
 # Initialize chat history
 if "messages" not in st.session_state:
     st.session_state["messages"] = []
 
+# One backend session per browser tab
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+
+if "timings" not in st.session_state:
+    st.session_state["timings"] = []
+
 st.title("🤖 Youssef Elkoumi AI Booking Agent")
 
 st.write("Chat with me to book meetings in your calendar!")
@@ -32,15 +95,33 @@ if user_input:
     st.chat_message("user").markdown(user_input)
     st.session_state["messages"].append({"role": "user", "content": user_input})
 
-    # Send message to FastAPI
-    payload = {"message": user_input}
-    try:
-        response = requests.post(API_URL, json=payload, timeout=20)
-        response.raise_for_status()
-        reply = response.json().get("reply", "Sorry, I didn't understand that.")
-    except Exception as e:
-        reply = f"⚠️ Error talking to the backend: {e}"
-
-    # Show bot reply
-    st.chat_message("assistant").markdown(reply)
+    # Send message to FastAPI and render the reply as it streams in
+    timings = {}
+    with st.chat_message("assistant"):
+        try:
+            status = st.empty()
+            reply = st.write_stream(
+                stream_reply(st.session_state["session_id"], user_input, timings, status)
+            )
+            if not reply:
+                reply = "Sorry, I didn't understand that."
+                st.markdown(reply)
+        except Exception as e:
+            reply = f"⚠️ Error talking to the backend: {e}"
+            st.markdown(reply)
+
     st.session_state["messages"].append({"role": "assistant", "content": reply})
+    st.session_state["timings"].append(timings)
+
+# Client-side latency for the last few turns
+with st.sidebar.expander("Debug"):
+    st.write(f"Backend: `{BACKEND_URL}`")
+    st.write(f"Session: `{st.session_state['session_id']}`")
+    for i, t in enumerate(st.session_state["timings"][-10:], start=1):
+        first = t.get("first_byte_ms")
+        total = t.get("total_ms")
+        st.write(
+            f"Turn {i}: first byte "
+            f"{f'{first:.0f} ms' if first is not None else 'n/a'}, total "
+            f"{f'{total:.0f} ms' if total is not None else 'n/a'}"
+        )
@@ -0,0 +1,211 @@
+# availability.py
+#
+# Bitmap availability engine: every calendar is a row of a boolean NumPy
+# matrix with one column per time bin over the horizon, so intersections,
+# "N of M attendees free" and free-run searches are plain array operations.
+
+from datetime import date, datetime, timedelta, timezone
+from operator import attrgetter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+RESOLUTION_MINUTES = 5
+# Spacing of the probes that look for UTC offset changes; no zone changes twice this quickly
+OFFSET_PROBE_SECONDS = 6 * 3600
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+Interval = Tuple[datetime, datetime]
+
+
+def as_utc(when: datetime) -> datetime:
+    """Aware datetimes in UTC, so subtraction gives elapsed time across DST changes"""
+    return when.astimezone(timezone.utc) if when.tzinfo else when
+
+
+def wall_seconds(times: Sequence[datetime]) -> np.ndarray:
+    """Wall-clock reading of every datetime as seconds since 1970-01-01 00:00, ignoring timezones"""
+    count = len(times)
+    seconds = (np.fromiter(map(datetime.toordinal, times), dtype=np.int64, count=count) - EPOCH_ORDINAL) * 86400
+    for field, scale in (("hour", 3600), ("minute", 60), ("second", 1)):
+        seconds += np.fromiter(map(attrgetter(field), times), dtype=np.int64, count=count) * scale
+    return seconds + np.fromiter(map(attrgetter("microsecond"), times), dtype=np.int64, count=count) / 1e6
+
+
+def offset_changes(tz, lo: float, hi: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Epoch seconds in [lo, hi] at which `tz` changes its UTC offset, and the
+    offsets in seconds before, between and after those changes
+    """
+    def offset_at(ts):
+        return datetime.fromtimestamp(ts, tz).utcoffset().total_seconds()
+
+    changes = []
+    offsets = [offset_at(lo)]
+    probe = int(lo)
+    while probe < hi:
+        following = min(probe + OFFSET_PROBE_SECONDS, int(hi) + 1)
+        offset = offset_at(following)
+        if offset != offsets[-1]:
+            # Narrow the change down to the second
+            before, after = probe, following
+            while after - before > 1:
+                middle = (before + after) // 2
+                if offset_at(middle) == offsets[-1]:
+                    before = middle
+                else:
+                    after = middle
+            changes.append(after)
+            offsets.append(offset)
+        probe = following
+    return np.asarray(changes, dtype=np.float64), np.asarray(offsets, dtype=np.float64)
+
+
+def epoch_seconds(times: Sequence[datetime]) -> np.ndarray:
+    """Seconds since the Unix epoch of every datetime; naive ones are read as UTC"""
+    wall = wall_seconds(times)
+    if not len(wall):
+        return wall
+
+    zones = list(map(attrgetter("tzinfo"), times))
+    unique = set(zones)
+    if len(unique) == 1:
+        groups = [(unique.pop(), slice(None))]
+    else:
+        index = {tz: i for i, tz in enumerate(unique)}
+        group = np.fromiter((index[tz] for tz in zones), dtype=np.int64, count=len(zones))
+        groups = [(tz, group == i) for tz, i in index.items()]
+
+    seconds = wall.copy()
+    for tz, which in groups:
+        if tz is None:
+            continue
+        local = wall[which]
+        changes, offsets = offset_changes(tz, local.min() - 86400, local.max() + 86400)
+        # Wall-clock reading from which each new offset applies (fold=0 picks the earlier
+        # offset for times skipped or repeated by the change)
+        boundaries = changes + np.maximum(offsets[:-1], offsets[1:])
+        seconds[which] = local - offsets[np.searchsorted(boundaries, local, side="right")]
+
+    # The repeated hour after clocks go back (fold=1) is rare, convert those one by one
+    folds = np.fromiter(map(attrgetter("fold"), times), dtype=np.bool_, count=len(times))
+    for i in np.flatnonzero(folds):
+        if times[i].tzinfo is not None:
+            seconds[i] = times[i].timestamp()
+    return seconds
+
+
+class AvailabilityGrid:
+    """
+    Busy bitmap for many calendars over a fixed horizon.
+
+    busy[i, j] is True when calendar_ids[i] has anything booked during bin j,
+    which covers [start + j * resolution, start + (j + 1) * resolution) in
+    elapsed time. A bin that is only partly busy counts as busy.
+    Bin times are given back in the timezone of `start`.
+    """
+
+    def __init__(self, calendar_ids: List[str], busy: np.ndarray, start: datetime,
+                 resolution: int = RESOLUTION_MINUTES):
+        self.calendar_ids = calendar_ids
+        self.busy = busy
+        self.start = start
+        self.origin = as_utc(start)
+        self.origin_seconds = epoch_seconds([start])[0]
+        self.resolution = resolution
+
+    @classmethod
+    def from_intervals(cls, intervals: Dict[str, Sequence[Interval]], start: datetime,
+                       end: datetime, resolution: int = RESOLUTION_MINUTES) -> "AvailabilityGrid":
+        """Build the grid from freebusy intervals, one entry per calendar"""
+        calendar_ids = list(intervals)
+        origin, finish = epoch_seconds([start, end])
+        step = resolution * 60
+        n_bins = int(np.ceil((finish - origin) / step))
+
+        counts = [len(intervals[calendar_id]) for calendar_id in calendar_ids]
+        flat = [edge for calendar_id in calendar_ids
+                for interval in intervals[calendar_id] for edge in interval]
+        edges = ((epoch_seconds(flat) - origin) / step).reshape(-1, 2)
+
+        # Difference array per row: +1 where a busy interval starts, -1 after it ends
+        size = len(calendar_ids) * (n_bins + 1)
+        diff = np.zeros(size, dtype=np.int32)
+        if len(edges):
+            offset = np.repeat(np.arange(len(calendar_ids)) * (n_bins + 1), counts)
+            first = np.clip(np.floor(edges[:, 0]), 0, n_bins).astype(np.int64)
+            last = np.clip(np.ceil(edges[:, 1]), 0, n_bins).astype(np.int64)
+            keep = last > first
+            diff += np.bincount(offset[keep] + first[keep], minlength=size).astype(np.int32)
+            diff -= np.bincount(offset[keep] + last[keep], minlength=size).astype(np.int32)
+        diff = diff.reshape(len(calendar_ids), n_bins + 1)
+        busy = np.cumsum(diff[:, :-1], axis=1) > 0
+
+        return cls(calendar_ids, busy, start, resolution)
+
+    @property
+    def n_bins(self) -> int:
+        return self.busy.shape[1]
+
+    def bin_time(self, index: int) -> datetime:
+        when = self.origin + timedelta(minutes=self.resolution * int(index))
+        return when.astimezone(self.start.tzinfo) if self.start.tzinfo else when
+
+    def bin_index(self, when: datetime) -> int:
+        return int((as_utc(when) - self.origin) // timedelta(minutes=self.resolution))
+
+    def rows(self, calendar_ids: Optional[Sequence[str]] = None) -> np.ndarray:
+        if calendar_ids is None:
+            return self.busy
+        index = {calendar_id: row for row, calendar_id in enumerate(self.calendar_ids)}
+        return self.busy[[index[calendar_id] for calendar_id in calendar_ids]]
+
+    def free_count(self, calendar_ids: Optional[Sequence[str]] = None) -> np.ndarray:
+        """Number of free calendars in every bin"""
+        busy = self.rows(calendar_ids)
+        return busy.shape[0] - busy.sum(axis=0, dtype=np.int32)
+
+    def all_free(self, calendar_ids: Optional[Sequence[str]] = None) -> np.ndarray:
+        """Bins where every calendar is free"""
+        return ~self.rows(calendar_ids).any(axis=0)
+
+    def quorum_free(self, n: int, calendar_ids: Optional[Sequence[str]] = None) -> np.ndarray:
+        """Bins where at least `n` of the calendars are free"""
+        return self.free_count(calendar_ids) >= n
+
+    def working_hours(self, start_hour: int = 9, end_hour: int = 18) -> np.ndarray:
+        """Bins that fall inside working hours, by the local time of each bin"""
+        bins = self.origin_seconds + self.resolution * 60 * np.arange(self.n_bins)
+        tz = self.start.tzinfo
+        if tz is not None and self.n_bins:
+            changes, offsets = offset_changes(tz, bins[0], bins[-1])
+            bins = bins + offsets[np.searchsorted(changes, bins, side="right")]
+        minute_of_day = (bins // 60) % (24 * 60)
+        return (minute_of_day >= start_hour * 60) & (minute_of_day < end_hour * 60)
+
+    def find_runs(self, free: np.ndarray, duration_minutes: int,
+                  step_minutes: Optional[int] = None, limit: Optional[int] = None) -> List[datetime]:
+        """
+        Start times where `free` holds for `duration_minutes` in a row.
+        `step_minutes` restricts starts to multiples of that step from the grid start,
+        rounded up to whole bins.
+        """
+        length = int(np.ceil(duration_minutes / self.resolution))
+        if length > len(free):
+            return []
+
+        # Sliding-window sum over a cumulative count of free bins
+        counts = np.concatenate(([0], np.cumsum(free, dtype=np.int32)))
+        starts = np.flatnonzero(counts[length:] - counts[:-length] == length)
+        if step_minutes:
+            stride = -(-step_minutes // self.resolution)
+            starts = starts[starts % stride == 0]
+        if limit is not None:
+            starts = starts[:limit]
+        return [self.bin_time(index) for index in starts]
+
+    def is_free(self, calendar_id: str, start: datetime, end: datetime) -> bool:
+        first = max(self.bin_index(start), 0)
+        last = min(int(np.ceil((as_utc(end) - self.origin) / timedelta(minutes=self.resolution))), self.n_bins)
+        return not self.rows([calendar_id])[0, first:last].any()
@@ -0,0 +1,283 @@
+# bench.py
+#
+# Small benchmark harness for the agent's hot paths.
+# Usage: python bench.py [name ...]   (no names = run everything)
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Keep benchmark conversations and bookings out of the real databases
+os.environ.setdefault("CHECKPOINT_DB", os.path.join(tempfile.mkdtemp(), "bench.sqlite"))
+os.environ.setdefault("OUTBOX_DB", os.path.join(tempfile.mkdtemp(), "outbox.sqlite"))
+
+
+def measure(fn, iterations=20000):
+    """Return (CPU microseconds per call, wall microseconds per call)"""
+    fn()  # warm up caches
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    cpu = (time.process_time() - cpu_start) / iterations * 1e6
+    wall = (time.perf_counter() - wall_start) / iterations * 1e6
+    return cpu, wall
+
+
+def report(name, cpu, wall):
+    print(f"  {name:<28} {cpu:8.2f} us cpu  {wall:8.2f} us wall")
+
+
+def replay_workload(turns, days=14, change_rate=0.2, seed=0):
+    """
+    (day, free slots) per turn as a replay would see them: requests spread over
+    the next `days` days, and each day's free slots change on `change_rate` of turns
+    """
+    import random
+
+    rng = random.Random(seed)
+    first = datetime(2025, 7, 1).date()
+    hours = list(range(9, 18))
+    free = {}
+    workload = []
+    for _ in range(turns):
+        day = first + timedelta(days=rng.randrange(days))
+        if day not in free or rng.random() < change_rate:
+            free[day] = tuple(
+                datetime.combine(day, datetime.min.time()).replace(hour=hour)
+                for hour in sorted(rng.sample(hours, rng.randint(1, 5)))
+            )
+        workload.append((day, free[day]))
+    return workload
+
+
+def bench_replies(iterations=20000):
+    """Reply rendering: inline f-strings/strftime vs the precompiled registry"""
+    from replies import TEMPLATES, _STATIC, _locale, render, format_datetime, suggestion_reply
+
+    start = datetime(2025, 7, 1, 15, 30)
+    email = "me@example.com"
+    message = "maybe tomorrow"
+
+    def render_format_map(key, locale=None, **fields):
+        """render() with str.format_map on the stored template instead of the fragment join"""
+        locale = _locale(locale)
+        if key in _STATIC[locale]:
+            return TEMPLATES[locale][key]
+        return TEMPLATES[locale][key].format_map(fields)
+
+    print("render one reply (booking_provisional):")
+    when = format_datetime(start)
+    for name, fn in (
+        ("inline f-string", lambda: f"📅 I'm adding your meeting for {when} to the calendar now. "
+                                    f"The invite will go to {email} as soon as it's there."),
+        ("render, fragment join", lambda: render("booking_provisional", when=when, email=email)),
+        ("render, str.format_map", lambda: render_format_map("booking_provisional", when=when, email=email)),
+    ):
+        report(name, *measure(fn, iterations * 10))
+
+    workloads = (
+        ("replay", replay_workload(iterations + 1)),
+        ("all distinct", [
+            (start.date() + timedelta(days=i), (start + timedelta(days=i, minutes=i % 60),))
+            for i in range(iterations + 1)
+        ]),
+    )
+    for label, workload in workloads:
+        turns = iter(workload)
+
+        def old_turn():
+            day, slots = next(turns)
+            times_str = ", ".join(slot.strftime("%H:%M") for slot in slots)
+            f"Sorry, that time slot is busy. But I'm free at these times on {day}: {times_str}. Would you like one of those?"
+            f"📅 I'm adding your meeting for {start.strftime('%Y-%m-%d %H:%M')} to the calendar now. The invite will go to {email} as soon as it's there."
+            f"I detected time-related words in '{message}' but couldn't parse the exact time. Please try formats like 'tomorrow at 3pm' or 'next Monday at 2:30pm'."
+
+        def new_turn():
+            day, slots = next(turns)
+            suggestion_reply(day, slots)
+            render("booking_provisional", when=format_datetime(start), email=email)
+            render("unparsed_time", message=message)
+
+        old_cpu, old_wall = measure(old_turn, iterations)
+        turns = iter(workload)
+        suggestion_reply.cache_clear()
+        new_cpu, new_wall = measure(new_turn, iterations)
+        info = suggestion_reply.cache_info()
+
+        print(f"replies, {label} (suggest + provisional + fallback per turn):")
+        report("inline formatting", old_cpu, old_wall)
+        report("template registry", new_cpu, new_wall)
+        print(f"  suggestion cache hit rate: {info.hits / (info.hits + info.misses) * 100:.0f}%")
+        print(f"  per-turn CPU change: {(new_cpu / old_cpu - 1) * 100:+.0f}%")
+
+
+class CalendarStub:
+    """In-process stand-in for the Google Calendar service: everything is free"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def freebusy(self):
+        return self
+
+    def events(self):
+        return self
+
+    def query(self, body):
+        self.response = {"calendars": {item["id"]: {"busy": []} for item in body["items"]}}
+        return self
+
+    def insert(self, calendarId, body, sendUpdates):
+        self.response = {"htmlLink": "https://calendar.example.com/event"}
+        return self
+
+    def execute(self):
+        time.sleep(self.latency)
+        return self.response
+
+
+def install_calendar_stub(latency=0.0):
+    """Point gcal at CalendarStub so the agent can be timed without Google credentials"""
+    import gcal
+
+    stub = CalendarStub(latency)
+    gcal.get_calendar_service = lambda timeout=None: stub
+    return stub
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def bench_fast_path():
+    """p50 latency of short messages with and without the pre-graph fast path"""
+    import contextlib
+    import io
+
+    install_calendar_stub()
+    import agent
+
+    turns = [
+        ("hi", {"conversation_state": "initial"}),
+        ("hello", {"conversation_state": "completed"}),
+        ("no", {"conversation_state": "awaiting_choice"}),
+        ("thanks", {"conversation_state": "initial"}),
+    ]
+
+    def run(use_fast_path, rounds=500):
+        samples = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(rounds):
+                for message, previous in turns:
+                    state = {**previous, "message": message}
+                    started = time.perf_counter()
+                    if use_fast_path:
+                        agent.run_turn(state)
+                    else:
+                        agent.app.invoke(state)
+                    samples.append((time.perf_counter() - started) * 1e6)
+        return samples
+
+    print("fast path (hi / hello / no / thanks):")
+    graph = run(False)
+    fast = run(True)
+    for name, samples in (("full graph", graph), ("fast path", fast)):
+        print(f"  {name:<28} p50 {percentile(samples, 50):8.1f} us  p99 {percentile(samples, 99):8.1f} us")
+    print(f"  p50 reduction: {(1 - percentile(fast, 50) / percentile(graph, 50)) * 100:.0f}%")
+
+
+def bench_checkpoint():
+    """Per-turn cost of SQLite checkpointing, timed on the email -> booking turn"""
+    import contextlib
+    import io
+
+    install_calendar_stub()
+    import agent
+
+    # The first turn goes through dateparser, which would drown out the checkpoint cost
+    setup_message, timed_message = "book a call tomorrow at 3pm", "me@example.com"
+
+    def run(durable, rounds=200):
+        samples = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(rounds):
+                if durable:
+                    agent.handle_message(setup_message, f"bench-{i}")
+                    started = time.perf_counter()
+                    agent.handle_message(timed_message, f"bench-{i}")
+                else:
+                    _, state = agent.handle_message_with_state(setup_message)
+                    started = time.perf_counter()
+                    agent.handle_message_with_state(timed_message, state)
+                samples.append((time.perf_counter() - started) * 1e3)
+        return samples
+
+    print("checkpointing (email -> booking turn):")
+    memory = run(False)
+    durable = run(True)
+    for name, samples in (("in-memory state", memory), ("sqlite checkpoints", durable)):
+        print(f"  {name:<28} p50 {percentile(samples, 50):8.2f} ms  p99 {percentile(samples, 99):8.2f} ms")
+    print(f"  p50 overhead per turn: {percentile(durable, 50) - percentile(memory, 50):.2f} ms")
+
+
+def bench_bitmap(n_calendars=500, days=30, meetings_per_day=6):
+    """Availability queries over many calendars with the bitmap engine"""
+    import random
+    from zoneinfo import ZoneInfo
+
+    from availability import AvailabilityGrid
+
+    rng = random.Random(0)
+    start = datetime(2025, 7, 1, tzinfo=ZoneInfo("Africa/Cairo"))
+    end = start + timedelta(days=days)
+    intervals = {}
+    for c in range(n_calendars):
+        busy = []
+        for day in range(days):
+            for _ in range(meetings_per_day):
+                begin = start + timedelta(days=day, hours=rng.randint(8, 18), minutes=rng.choice((0, 15, 30, 45)))
+                busy.append((begin, begin + timedelta(minutes=rng.choice((15, 30, 60)))))
+        intervals[f"user{c}@example.com"] = busy
+
+    def timed(fn, repeat=5):
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - started)
+        return result, best * 1e3
+
+    grid, build_ms = timed(lambda: AvailabilityGrid.from_intervals(intervals, start, end))
+    team = grid.calendar_ids[:8]
+    # Each query builds its working-hours mask, as a caller would
+    _, hours_ms = timed(grid.working_hours)
+    _, team_ms = timed(lambda: grid.find_runs(grid.all_free(team) & grid.working_hours(), 30,
+                                              step_minutes=30, limit=10))
+    _, all_ms = timed(lambda: grid.find_runs(grid.all_free() & grid.working_hours(), 30))
+    _, quorum_ms = timed(lambda: grid.find_runs(grid.quorum_free(int(n_calendars * 0.8)) & grid.working_hours(), 60))
+
+    n_intervals = sum(len(busy) for busy in intervals.values())
+    print(f"bitmap ({n_calendars} calendars x {days} days, {n_intervals} busy intervals, {grid.n_bins} bins):")
+    print(f"  {'build from intervals':<28} {build_ms:8.2f} ms")
+    print(f"  {'working-hours mask':<28} {hours_ms:8.2f} ms")
+    print(f"  {'8 attendees, 30 min':<28} {team_ms:8.2f} ms")
+    print(f"  {'all attendees, 30 min':<28} {all_ms:8.2f} ms")
+    print(f"  {'80% of attendees, 60 min':<28} {quorum_ms:8.2f} ms")
+
+
+BENCHMARKS = {
+    "replies": bench_replies,
+    "fast_path": bench_fast_path,
+    "checkpoint": bench_checkpoint,
+    "bitmap": bench_bitmap,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
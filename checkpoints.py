@@ -0,0 +1,142 @@
+# checkpoints.py
+
+import contextvars
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+CHECKPOINT_DB = os.environ.get("CHECKPOINT_DB", "checkpoints.sqlite")
+# How many checkpoints to keep per conversation thread
+MAX_CHECKPOINTS_PER_THREAD = int(os.environ.get("MAX_CHECKPOINTS_PER_THREAD", "20"))
+# Seconds between background compaction runs
+COMPACT_INTERVAL = float(os.environ.get("CHECKPOINT_COMPACT_INTERVAL", "60"))
+
+
+class BatchedSqliteSaver(SqliteSaver):
+    """
+    SqliteSaver whose writes for one conversation turn go through a private
+    connection and are committed, or rolled back, together.
+
+    Inside `with saver.turn():` every checkpoint read and write made on behalf
+    of that turn (including from LangGraph's executor threads, which inherit the
+    context) uses the turn's own connection, so one turn's commit or rollback
+    never touches another turn's pending writes. Outside a turn the saver
+    behaves like the stock SqliteSaver and commits every write.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, path: str):
+        super().__init__(conn)
+        self.path = path
+        self._turn_conn = contextvars.ContextVar("checkpoint_turn_conn", default=None)
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        super().setup()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def turn(self):
+        """Commit the checkpoints written inside this block on success, roll them back on error"""
+        with self.lock:
+            self.setup()
+        conn = self._connect()
+        token = self._turn_conn.set(conn)
+        try:
+            yield
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._turn_conn.reset(token)
+            conn.close()
+
+    @contextmanager
+    def cursor(self, transaction: bool = True):
+        conn = self._turn_conn.get()
+        if conn is None:
+            with super().cursor(transaction) as cur:
+                yield cur
+            return
+        cur = conn.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+    def compact(self, keep: int = MAX_CHECKPOINTS_PER_THREAD) -> int:
+        """
+        Drop all but the newest `keep` checkpoints of every thread, along with
+        their pending writes. Returns the number of checkpoints removed.
+        """
+        with self.lock:
+            self.setup()
+            cur = self.conn.cursor()
+            try:
+                cur.execute(
+                    """
+                    DELETE FROM checkpoints
+                    WHERE (thread_id, checkpoint_ns, checkpoint_id) IN (
+                        SELECT thread_id, checkpoint_ns, checkpoint_id FROM (
+                            SELECT thread_id, checkpoint_ns, checkpoint_id,
+                                   ROW_NUMBER() OVER (
+                                       PARTITION BY thread_id, checkpoint_ns
+                                       ORDER BY checkpoint_id DESC
+                                   ) AS rank
+                            FROM checkpoints
+                        )
+                        WHERE rank > ?
+                    )
+                    """,
+                    (keep,),
+                )
+                removed = cur.rowcount
+                cur.execute(
+                    """
+                    DELETE FROM writes
+                    WHERE (thread_id, checkpoint_ns, checkpoint_id) NOT IN (
+                        SELECT thread_id, checkpoint_ns, checkpoint_id FROM checkpoints
+                    )
+                    """
+                )
+                self.conn.commit()
+            finally:
+                cur.close()
+        return removed
+
+
+def open_checkpointer(path: str = CHECKPOINT_DB) -> BatchedSqliteSaver:
+    """Open (or create) the checkpoint database"""
+    # Used outside of turns (compaction, the outbox worker), guarded by saver.lock
+    conn = sqlite3.connect(path, check_same_thread=False)
+    saver = BatchedSqliteSaver(conn, path)
+    saver.setup()
+    return saver
+
+
+def start_compaction(saver: BatchedSqliteSaver, interval: float = COMPACT_INTERVAL) -> threading.Thread:
+    """Compact old checkpoints every `interval` seconds on a daemon thread"""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                removed = saver.compact()
+                if removed:
+                    print(f"Compacted {removed} old checkpoints")
+            except Exception as e:
+                print(f"ERROR compacting checkpoints: {e}")
+
+    thread = threading.Thread(target=loop, name="checkpoint-compaction", daemon=True)
+    thread.stop = stop
+    thread.start()
+    return thread
@@ -2,18 +2,187 @@
 
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
+from google.auth.exceptions import TransportError
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp, Request as Httplib2Request
+from collections import OrderedDict
+from contextlib import contextmanager
+import contextvars
+import httplib2
 import pickle
 import os.path
+import threading
+import time
 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
 # Reuse credentials to avoid opening a browser each call
 _service = None
 
-def get_calendar_service():
+
+class CalendarUnavailable(RuntimeError):
+    """Google Calendar could not be reached in time (circuit open, deadline hit or API error)"""
+
+
+# --- Per-request deadlines ---
+
+class DeadlineExceeded(RuntimeError):
+    """The request deadline passed; the user has already been answered without this turn"""
+
+
+_deadline = contextvars.ContextVar("calendar_deadline", default=None)
+
+@contextmanager
+def calendar_deadline(seconds: float, margin: float = 0.0):
+    """
+    Calendar calls made inside this block must finish within `seconds`, less
+    `margin` seconds kept for the caller to answer after the last call
+    """
+    token = _deadline.set((time.monotonic() + seconds, margin))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining_time():
+    """Seconds left before the current deadline, or None if there is no deadline"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline[0] - time.monotonic()
+
+def deadline_passed() -> bool:
+    """True once the current deadline is over; side effects must not start after that"""
+    remaining = remaining_time()
+    return remaining is not None and remaining <= 0
+
+def call_budget():
+    """Seconds a calendar call may still take, or None if there is no deadline"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline[0] - deadline[1] - time.monotonic()
+
+
+# --- Circuit breaker ---
+
+class CircuitBreaker:
+    """
+    Stops calling the Calendar API after `failure_threshold` consecutive failures.
+    After `reset_timeout` seconds a single trial call is let through; success closes
+    the circuit again, failure keeps it open.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_in_flight or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def reset(self):
+        self.record_success()
+
+
+def is_transient(error):
+    """
+    Failures that say Google is unhealthy (timeouts, connection errors, 429, 5xx)
+    rather than that this one request was bad, e.g. a 400 for an invalid guest email
+    """
+    while error is not None:
+        if isinstance(error, HttpError):
+            status = int(error.resp.status)
+            return status == 429 or status >= 500
+        if isinstance(error, (OSError, httplib2.HttpLib2Error, TransportError)):
+            return True
+        error = error.__cause__
+    return False
+
+
+calendar_breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get("CALENDAR_FAILURE_THRESHOLD", "5")),
+    reset_timeout=float(os.environ.get("CALENDAR_RESET_TIMEOUT", "30")),
+)
+
+def call_calendar(request_fn):
+    """
+    Run `request_fn(timeout)` against the Calendar API through the circuit breaker,
+    with the HTTP timeout capped by the current request deadline.
+    """
+    timeout = call_budget()
+    if timeout is not None and timeout <= 0:
+        raise CalendarUnavailable("Request deadline exceeded before calling Google Calendar")
+    if not calendar_breaker.allow():
+        raise CalendarUnavailable("Google Calendar circuit is open")
+
+    try:
+        result = request_fn(timeout)
+    except Exception as e:
+        if is_transient(e):
+            calendar_breaker.record_failure()
+        else:
+            # Not a sign of an outage: the request itself was at fault
+            calendar_breaker.record_success()
+        raise CalendarUnavailable(f"Google Calendar call failed: {e}") from e
+
+    calendar_breaker.record_success()
+    return result
+
+
+# Last known answers from freebusy, used when the calendar is unavailable
+AVAILABILITY_CACHE_SIZE = 2048
+# Seconds a cached answer may be used for
+AVAILABILITY_CACHE_TTL = float(os.environ.get("AVAILABILITY_CACHE_TTL", "300"))
+_availability_cache = OrderedDict()
+_availability_lock = threading.Lock()
+
+def cache_availability(start_time, end_time, free):
+    with _availability_lock:
+        _availability_cache[(start_time, end_time)] = (free, time.monotonic())
+        _availability_cache.move_to_end((start_time, end_time))
+        while len(_availability_cache) > AVAILABILITY_CACHE_SIZE:
+            _availability_cache.popitem(last=False)
+
+def cached_availability(start_time, end_time):
+    """Last known answer for this slot, or None if there is none from the last AVAILABILITY_CACHE_TTL seconds"""
+    with _availability_lock:
+        entry = _availability_cache.get((start_time, end_time))
+    if entry is None or time.monotonic() - entry[1] > AVAILABILITY_CACHE_TTL:
+        return None
+    return entry[0]
+
+
+def get_calendar_service(timeout=None):
     creds = None
 
     # Check if token file exists
@@ -31,20 +200,28 @@ def get_calendar_service():
     if not creds:
         raise RuntimeError("Invalid credentials in token.pickle")
     
+    http = None
+    if timeout is not None:
+        # Bound the token refresh and every API request by what's left of the request deadline
+        http = httplib2.Http(timeout=max(timeout, 0.1))
+
     # Refresh if expired
     if not creds.valid:
         if creds.expired and creds.refresh_token:
             try:
-                creds.refresh(Request())
+                creds.refresh(Request() if http is None else Httplib2Request(http))
                 # Save refreshed token
                 with open('token.pickle', 'wb') as token:
                     pickle.dump(creds, token)
             except Exception as e:
-                raise RuntimeError(f"Failed to refresh credentials: {e}")
+                raise RuntimeError(f"Failed to refresh credentials: {e}") from e
         else:
             raise RuntimeError("Credentials expired and cannot be refreshed. Please re-authenticate.")
 
-    service = build('calendar', 'v3', credentials=creds)
+    if http is None:
+        service = build('calendar', 'v3', credentials=creds)
+    else:
+        service = build('calendar', 'v3', http=AuthorizedHttp(creds, http=http))
     return service
 
 
@@ -55,7 +232,17 @@ def check_availability(start_time, end_time):
     start_time, end_time: datetime objects (timezone-aware or naive)
     Returns: True if time slot is free, False if busy
     """
-    service = get_calendar_service()
+    return check_slot(start_time, end_time)[0]
+
+
+def check_slot(start_time, end_time):
+    """
+    Same as check_availability, but returns (free, from_cache).
+
+    When the calendar is unavailable the last known answer for the slot is
+    returned with from_cache=True; without one, CalendarUnavailable is raised.
+    """
+    slot = (start_time, end_time)
     
     # Ensure datetime objects have timezone info
     cairo_tz = ZoneInfo("Africa/Cairo")
@@ -76,31 +263,90 @@ def check_availability(start_time, end_time):
     print(f"DEBUG: Checking availability from {start_time.isoformat()} to {end_time.isoformat()}")
     print(f"DEBUG: Request body: {body}")
 
+    def query(timeout):
+        service = get_calendar_service(timeout)
+        return service.freebusy().query(body=body).execute()
+
     try:
-        events_result = service.freebusy().query(body=body).execute()
-        busy_times = events_result['calendars']['primary']['busy']
-        print(f"DEBUG: Busy times found: {busy_times}")
-        return not busy_times
-    except Exception as e:
+        events_result = call_calendar(query)
+    except CalendarUnavailable as e:
         print(f"ERROR in check_availability: {e}")
         # Print more details about the error
-        if hasattr(e, 'resp'):
-            print(f"Response status: {e.resp.status}")
-            print(f"Response reason: {e.resp.reason}")
-        raise
+        cause = e.__cause__
+        if hasattr(cause, 'resp'):
+            print(f"Response status: {cause.resp.status}")
+            print(f"Response reason: {cause.resp.reason}")
+        cached = cached_availability(*slot)
+        if cached is None:
+            raise
+        print(f"DEBUG: Using cached availability: {cached}")
+        return cached, True
 
+    busy_times = events_result['calendars']['primary']['busy']
+    print(f"DEBUG: Busy times found: {busy_times}")
+    cache_availability(*slot, not busy_times)
+    return not busy_times, False
 
-def create_event(start_time, end_time, summary="Meeting with AI Bot", guest_email=None):
+
+# freebusy accepts at most this many calendars per query
+FREEBUSY_MAX_CALENDARS = 50
+
+def fetch_busy_intervals(calendar_ids, start_time, end_time):
+    """
+    Busy intervals for many calendars between start_time and end_time.
+
+    Returns: {calendar_id: [(busy_start, busy_end), ...]} with timezone-aware datetimes.
+    Raises CalendarUnavailable if any batch of calendars could not be fetched.
+    """
+    cairo_tz = ZoneInfo("Africa/Cairo")
+    if start_time.tzinfo is None:
+        start_time = start_time.replace(tzinfo=cairo_tz)
+    if end_time.tzinfo is None:
+        end_time = end_time.replace(tzinfo=cairo_tz)
+
+    calendar_ids = list(calendar_ids)
+    intervals = {}
+    for i in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS):
+        batch = calendar_ids[i:i + FREEBUSY_MAX_CALENDARS]
+        body = {
+            "timeMin": start_time.isoformat(),
+            "timeMax": end_time.isoformat(),
+            "timeZone": "Africa/Cairo",
+            "items": [{"id": calendar_id} for calendar_id in batch]
+        }
+
+        def query(timeout):
+            service = get_calendar_service(timeout)
+            return service.freebusy().query(body=body).execute()
+
+        calendars = call_calendar(query)['calendars']
+        for calendar_id in batch:
+            calendar = calendars.get(calendar_id, {})
+            if calendar.get('errors') or calendar_id not in calendars:
+                # Can't see this calendar, so don't claim it is free
+                print(f"ERROR in fetch_busy_intervals for {calendar_id}: {calendar.get('errors')}")
+                intervals[calendar_id] = [(start_time, end_time)]
+                continue
+            intervals[calendar_id] = [
+                (datetime.fromisoformat(busy['start']), datetime.fromisoformat(busy['end']))
+                for busy in calendar.get('busy', [])
+            ]
+    return intervals
+
+
+def create_event(start_time, end_time, summary="Meeting with AI Bot", guest_email=None, event_id=None):
     """
     Creates a calendar event.
 
     start_time, end_time: datetime objects (timezone-aware or naive)
     summary: title of the event
     guest_email: optional email address to invite
+    event_id: optional client-chosen id (base32hex); retrying with the same id
+              returns the existing event instead of creating a duplicate
 
     Returns: event link
+    Raises CalendarUnavailable if the event could not be created.
     """
-    service = get_calendar_service()
     
     cairo_tz = ZoneInfo("Africa/Cairo")
     
@@ -124,12 +370,24 @@ def create_event(start_time, end_time, summary="Meeting with AI Bot", guest_emai
 
     if guest_email:
         event['attendees'] = [{'email': guest_email}]
+    if event_id:
+        event['id'] = event_id
+
+    def insert(timeout):
+        service = get_calendar_service(timeout)
+        try:
+            return service.events().insert(
+                calendarId='primary',
+                body=event,
+                sendUpdates='all' if guest_email else 'none'
+            ).execute()
+        except HttpError as e:
+            # Already created by an earlier attempt
+            if event_id and e.resp.status == 409:
+                return service.events().get(calendarId='primary', eventId=event_id).execute()
+            raise
 
-    event_result = service.events().insert(
-        calendarId='primary',
-        body=event,
-        sendUpdates='all' if guest_email else 'none'
-    ).execute()
+    event_result = call_calendar(insert)
 
     return event_result.get('htmlLink')
 
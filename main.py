@@ -1,17 +1,117 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from agent import handle_message
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from agent import handle_message, checkpointer, outbox, record_booking_link, record_booking_failure
+from checkpoints import start_compaction
+from gcal import calendar_deadline
+from outbox import start_worker
+from replies import render
 
-app = FastAPI()
+# Requests allowed to run at once; the rest get an immediate "busy" reply
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", "32"))
+# Seconds a request may take before we answer without waiting for it
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", "8"))
+# Part of the deadline kept for the agent itself after the last calendar call
+DEADLINE_MARGIN = 0.5
+# Seconds before /chat/stream sends a progress event for a slow turn
+PROGRESS_AFTER = float(os.environ.get("PROGRESS_AFTER", "0.3"))
+
+# Turns currently running in the threadpool, including ones past their deadline
+in_flight = 0
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Trim old conversation checkpoints in the background
+    compaction = start_compaction(checkpointer)
+    # Write queued bookings to Google Calendar off the request path
+    worker = start_worker(outbox, on_created=record_booking_link, on_failed=record_booking_failure)
+    yield
+    worker.stop.set()
+    outbox.wakeup.set()
+    compaction.stop.set()
+
+app = FastAPI(lifespan=lifespan)
+
+def handle_message_within(message: str, session_id: str, deadline: float) -> str:
+    """
+    Run a turn that must be answered by `deadline` (a time.monotonic() value).
+    Calendar calls stop DEADLINE_MARGIN before it; a turn still running after
+    it books nothing and keeps no state.
+    """
+    with calendar_deadline(deadline - time.monotonic(), margin=DEADLINE_MARGIN):
+        return handle_message(message, session_id)
+
+async def answer(user_message: str, session_id: str) -> str:
+    """Admission control around handle_message: bounded concurrency and a hard deadline"""
+    global in_flight
+    if in_flight >= MAX_IN_FLIGHT:
+        return render("overloaded")
+
+    in_flight += 1
+
+    def release(finished):
+        global in_flight
+        in_flight -= 1
+        # Nobody reads the result of a turn that ran past its deadline
+        if not finished.cancelled():
+            finished.exception()
+
+    # The slot is freed when the thread finishes, not when we stop waiting for it
+    deadline = time.monotonic() + REQUEST_DEADLINE
+    task = asyncio.ensure_future(run_in_threadpool(
+        handle_message_within, user_message, session_id, deadline
+    ))
+    task.add_done_callback(release)
+
+    done, _ = await asyncio.wait({task}, timeout=REQUEST_DEADLINE)
+    if not done:
+        return render("timed_out")
+    return task.result()
 
 @app.post("/chat")
 async def chat(request: Request):
     try:
         data = await request.json()
         user_message = data.get("message", "")
-        
-        reply = handle_message(user_message)
+        session_id = data.get("session_id") or "default"
+
+        reply = await answer(user_message, session_id)
         return {"reply": reply}
-    
+
     except Exception as e:
         # This will show you the actual error in your frontend
         return {"reply": f"⚠️ Backend error: {str(e)}"}
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """
+    Same as /chat but answers with newline-delimited JSON events:
+    {"progress": ...} while a slow turn is still running, then {"reply": ...}.
+    """
+    try:
+        data = await request.json()
+        user_message = data.get("message", "")
+        session_id = data.get("session_id") or "default"
+    except Exception as e:
+        # A body we can't read still gets an answer in the stream format
+        event = json.dumps({"reply": f"⚠️ Backend error: {str(e)}"}) + "\n"
+        return StreamingResponse(iter([event.encode("utf-8")]), media_type="application/x-ndjson")
+
+    async def body():
+        task = asyncio.ensure_future(answer(user_message, session_id))
+        # Let the client show something while the calendar is being checked
+        done, _ = await asyncio.wait({task}, timeout=PROGRESS_AFTER)
+        if not done:
+            yield (json.dumps({"progress": render("working")}) + "\n").encode("utf-8")
+        try:
+            reply = await task
+        except Exception as e:
+            reply = f"⚠️ Backend error: {str(e)}"
+        yield (json.dumps({"reply": reply}) + "\n").encode("utf-8")
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
@@ -0,0 +1,245 @@
+# outbox.py
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from gcal import create_event, fetch_busy_intervals, calendar_deadline, CalendarUnavailable
+
+OUTBOX_DB = os.environ.get("OUTBOX_DB", "outbox.sqlite")
+# Bookings sent to Google per worker pass
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "10"))
+# Failed attempts before a booking is dead-lettered
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+# Seconds between worker passes when nothing wakes it up
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "5"))
+# Seconds one event insert may take before it counts as failed
+OUTBOX_CALL_TIMEOUT = float(os.environ.get("OUTBOX_CALL_TIMEOUT", "20"))
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 300.0
+
+# HTTP statuses that won't get better by retrying
+PERMANENT_STATUSES = {400, 401, 403, 404}
+
+
+class SlotTaken(RuntimeError):
+    """A booking taken while the calendar was down turned out to clash with another event"""
+
+
+class Outbox:
+    """
+    Durable queue of bookings waiting to be written to Google Calendar.
+
+    Rows move from 'pending' to 'done' once the event exists, or to 'dead'
+    after OUTBOX_MAX_ATTEMPTS failures or a permanent API error.
+
+    Degraded rows were accepted without seeing the calendar; their slot is
+    checked again before the event is created and they are dead-lettered if
+    it has been taken meanwhile.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        with self.lock:
+            self.conn.executescript(
+                """
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS bookings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_id TEXT NOT NULL UNIQUE,
+                    session_id TEXT,
+                    start_time TEXT NOT NULL,
+                    end_time TEXT NOT NULL,
+                    summary TEXT NOT NULL,
+                    guest_email TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    html_link TEXT,
+                    degraded INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS bookings_due ON bookings (status, next_attempt_at);
+                """
+            )
+
+    def enqueue(self, start_time: datetime, end_time: datetime, summary: str,
+                guest_email=None, session_id=None, degraded: bool = False) -> int:
+        """Store a booking durably and wake the worker. Returns the booking id."""
+        now = time.time()
+        # Client-chosen event id, so a retry after a crash can't create a duplicate
+        event_id = uuid.uuid4().hex
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT INTO bookings (event_id, session_id, start_time, end_time, summary, guest_email, degraded, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (event_id, session_id, start_time.isoformat(), end_time.isoformat(), summary, guest_email, int(degraded), now, now),
+            )
+            self.conn.commit()
+        self.wakeup.set()
+        return cur.lastrowid
+
+    def due(self, limit: int = OUTBOX_BATCH_SIZE) -> list:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, event_id, session_id, start_time, end_time, summary, guest_email, attempts, degraded "
+                "FROM bookings WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+        return [
+            {
+                "id": row[0],
+                "event_id": row[1],
+                "session_id": row[2],
+                "start_time": datetime.fromisoformat(row[3]),
+                "end_time": datetime.fromisoformat(row[4]),
+                "summary": row[5],
+                "guest_email": row[6],
+                "attempts": row[7],
+                "degraded": bool(row[8]),
+            }
+            for row in rows
+        ]
+
+    def get(self, booking_id: int) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, attempts, last_error, html_link, degraded, start_time FROM bookings WHERE id = ?",
+                (booking_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "status": row[0],
+            "attempts": row[1],
+            "last_error": row[2],
+            "html_link": row[3],
+            "degraded": bool(row[4]),
+            "start_time": datetime.fromisoformat(row[5]),
+        }
+
+    def count(self, status: str = "pending") -> int:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM bookings WHERE status = ?", (status,)
+            ).fetchone()[0]
+
+    def drain(self, on_created=None, on_failed=None, batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+        """
+        Send one batch of due bookings to Google Calendar and record the outcome
+        of the whole batch in a single transaction.
+        `on_created(session_id, booking_id, html_link)` is called for every created event
+        and `on_failed(session_id, booking_id, error)` for every dead-lettered booking.
+        Returns the number of events created.
+        """
+        results = []
+        # Degraded bookings whose slot was seen free, so a retry won't mistake our own event for a clash
+        verified = set()
+        for booking in self.due(batch_size):
+            try:
+                if booking["degraded"]:
+                    with calendar_deadline(OUTBOX_CALL_TIMEOUT):
+                        busy = fetch_busy_intervals(["primary"], booking["start_time"], booking["end_time"])["primary"]
+                    if busy:
+                        raise SlotTaken(f"Slot was taken while the calendar was unavailable: {busy}")
+                    verified.add(booking["id"])
+                with calendar_deadline(OUTBOX_CALL_TIMEOUT):
+                    link = create_event(
+                        booking["start_time"],
+                        booking["end_time"],
+                        summary=booking["summary"],
+                        guest_email=booking["guest_email"],
+                        event_id=booking["event_id"],
+                    )
+            except SlotTaken as e:
+                results.append((booking, None, e, True))
+                continue
+            except CalendarUnavailable as e:
+                if e.__cause__ is None:
+                    # Circuit open: nothing was attempted, leave the rest for later
+                    results.append((booking, None, e, False))
+                    break
+                results.append((booking, None, e, True))
+                continue
+            results.append((booking, link, None, True))
+
+        created = []
+        failed = []
+        now = time.time()
+        with self.lock:
+            for booking, link, error, attempted in results:
+                if error is None:
+                    self.conn.execute(
+                        "UPDATE bookings SET status = 'done', attempts = attempts + 1, html_link = ?, last_error = NULL WHERE id = ?",
+                        (link, booking["id"]),
+                    )
+                    created.append((booking, link))
+                    continue
+
+                attempts = booking["attempts"] + (1 if attempted else 0)
+                status_code = getattr(getattr(error.__cause__, "resp", None), "status", None)
+                dead = (attempts >= OUTBOX_MAX_ATTEMPTS or status_code in PERMANENT_STATUSES
+                        or isinstance(error, SlotTaken))
+                delay = min(RETRY_BASE_DELAY * 2 ** attempts, RETRY_MAX_DELAY)
+                degraded = booking["degraded"] and booking["id"] not in verified
+                self.conn.execute(
+                    "UPDATE bookings SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, degraded = ? WHERE id = ?",
+                    ("dead" if dead else "pending", attempts, now + delay, str(error), int(degraded), booking["id"]),
+                )
+                if dead:
+                    print(f"ERROR booking {booking['id']} dead-lettered after {attempts} attempts: {error}")
+                    failed.append((booking, str(error)))
+            self.conn.commit()
+
+        for booking, link in created:
+            print(f"Created booking {booking['id']} for {booking['guest_email']}: {link}")
+            if on_created and booking["session_id"]:
+                try:
+                    on_created(booking["session_id"], booking["id"], link)
+                except Exception as e:
+                    print(f"ERROR recording booking {booking['id']} on session: {e}")
+        for booking, error in failed:
+            if on_failed and booking["session_id"]:
+                try:
+                    on_failed(booking["session_id"], booking["id"], error)
+                except Exception as e:
+                    print(f"ERROR recording failed booking {booking['id']} on session: {e}")
+        return len(created)
+
+
+def open_outbox(path: str = OUTBOX_DB) -> Outbox:
+    """Open (or create) the booking outbox"""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    return Outbox(conn)
+
+
+def start_worker(outbox: Outbox, on_created=None, on_failed=None,
+                 interval: float = OUTBOX_POLL_INTERVAL) -> threading.Thread:
+    """Drain the outbox on a daemon thread, right after each enqueue and every `interval` seconds"""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.is_set():
+            outbox.wakeup.wait(interval)
+            outbox.wakeup.clear()
+            if stop.is_set():
+                break
+            try:
+                # Keep going while full batches come back
+                while outbox.drain(on_created, on_failed) >= OUTBOX_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                print(f"ERROR draining booking outbox: {e}")
+
+    thread = threading.Thread(target=loop, name="booking-outbox", daemon=True)
+    thread.stop = stop
+    thread.start()
+    return thread
@@ -0,0 +1,130 @@
+# replies.py
+
+from datetime import date as date_type, datetime
+from functools import lru_cache
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_LOCALE = "en"
+
+# Reply templates per locale. Placeholders use str.format syntax.
+TEMPLATES: Dict[str, Dict[str, str]] = {
+    "en": {
+        "greeting": "Hi there! When would you like to book your appointment?",
+        "ask_email": "Great! Before I book this meeting, could you please provide your email so I can add it to the calendar invite?",
+        "bad_email": "Hmm, that doesn't look like a valid email. Please type your email address.",
+        "booking_provisional": (
+            "📅 I'm adding your meeting for {when} to the calendar now. "
+            "The invite will go to {email} as soon as it's there."
+        ),
+        "booking_failed": (
+            "⚠️ I couldn't add your meeting for {when} to the calendar, so it is not booked. "
+            "Please suggest another time if you'd still like to meet."
+        ),
+        "booking_failed_unknown": (
+            "⚠️ I couldn't add your last meeting to the calendar, so it is not booked. "
+            "Please suggest another time if you'd still like to meet."
+        ),
+        "slot_busy": "Sorry, that time slot is busy. Please suggest another time.",
+        "suggest": "Sorry, that time slot is busy. But I'm free at these times on {date}: {times}. Would you like one of those?",
+        "no_slots": "Sorry, that time slot is busy and I found no other free times on {date}. Please suggest another day or time.",
+        "rejection": "No problem! Please suggest another time that works for you (e.g., 'tomorrow at 2pm' or 'Friday at 10am').",
+        "unparsed_time": (
+            "I detected time-related words in '{message}' but couldn't parse the exact time. "
+            "Please try formats like 'tomorrow at 3pm' or 'next Monday at 2:30pm'."
+        ),
+        "no_time": (
+            "I couldn't find any time information in your message. "
+            "Please try something like 'book me a call tomorrow at 3pm'."
+        ),
+        "not_sure": "I'm not sure how to help with that. Please try booking a meeting with a specific time.",
+        "booking_queued": (
+            "I couldn't reach the calendar just now, so I've queued your meeting for {when}. "
+            "We'll send the invite to {email} once it's on the calendar, "
+            "or let you know here if that time turns out to be taken."
+        ),
+        "working": "Checking the calendar…",
+        "overloaded": "I'm handling a lot of requests right now. Please try again in a moment.",
+        "timed_out": (
+            "The calendar is responding slowly and I couldn't answer in time. "
+            "If your booking was already on its way it will still go through; "
+            "otherwise please send your message again in a moment."
+        ),
+    },
+}
+
+# Date/time formats per locale
+FORMATS: Dict[str, Dict[str, str]] = {
+    "en": {
+        "datetime": "%Y-%m-%d %H:%M",
+        "time": "%H:%M",
+        "slot_separator": ", ",
+    },
+}
+
+# A compiled template is a tuple of (literal, field name or None) fragments
+Fragments = Tuple[Tuple[str, Optional[str]], ...]
+
+
+def _compile(template: str) -> Fragments:
+    fragments: List[Tuple[str, Optional[str]]] = []
+    for literal, field, _spec, _conv in Formatter().parse(template):
+        fragments.append((literal, field))
+    return tuple(fragments)
+
+
+# Compiled once at import time
+_COMPILED: Dict[str, Dict[str, Fragments]] = {
+    locale: {key: _compile(text) for key, text in templates.items()}
+    for locale, templates in TEMPLATES.items()
+}
+
+
+# Templates with no placeholders, which render() can hand back as-is
+_STATIC: Dict[str, frozenset] = {
+    locale: frozenset(
+        key for key, fragments in compiled.items()
+        if all(field is None for _literal, field in fragments)
+    )
+    for locale, compiled in _COMPILED.items()
+}
+
+
+def _locale(locale: Optional[str]) -> str:
+    return locale if locale in _COMPILED else DEFAULT_LOCALE
+
+
+def render(key: str, locale: Optional[str] = None, **fields) -> str:
+    """
+    Build a reply from its precompiled fragments.
+    Templates without placeholders come back as the stored string;
+    a missing field raises KeyError.
+    """
+    locale = _locale(locale)
+    if key in _STATIC[locale]:
+        return TEMPLATES[locale][key]
+
+    parts = []
+    for literal, field in _COMPILED[locale][key]:
+        parts.append(literal)
+        if field is not None:
+            parts.append(str(fields[field]))
+    return "".join(parts)
+
+
+def format_datetime(dt: datetime, locale: Optional[str] = None) -> str:
+    return dt.strftime(FORMATS[_locale(locale)]["datetime"])
+
+
+def format_slots(date: date_type, slots: Tuple[datetime, ...], locale: Optional[str] = None) -> str:
+    """Format a list of suggested start times (memoized through suggestion_reply)"""
+    fmt = FORMATS[_locale(locale)]
+    return fmt["slot_separator"].join(slot.strftime(fmt["time"]) for slot in slots)
+
+
+@lru_cache(maxsize=1024)
+def suggestion_reply(date: date_type, slots: Tuple[datetime, ...], locale: Optional[str] = None) -> str:
+    """Full 'here are other free times' reply, memoized on (date, slots, locale)"""
+    if not slots:
+        return render("no_slots", locale, date=date)
+    return render("suggest", locale, date=date, times=format_slots(date, slots, locale))
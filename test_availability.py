@@ -0,0 +1,134 @@
+# test_availability.py
+
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from availability import AvailabilityGrid, epoch_seconds
+
+CAIRO = ZoneInfo("Africa/Cairo")
+START = datetime(2025, 7, 1, 9, tzinfo=CAIRO)
+END = START + timedelta(hours=2)
+
+
+def at(hour, minute=0, day=1):
+    return datetime(2025, 7, day, hour, minute, tzinfo=CAIRO)
+
+
+def busy_bins(grid, calendar_id="a"):
+    return np.flatnonzero(grid.rows([calendar_id])[0]).tolist()
+
+
+def test_interval_edges_land_on_bins():
+    grid = AvailabilityGrid.from_intervals({"a": [(at(9, 10), at(9, 20))]}, START, END)
+    assert grid.n_bins == 24
+    # [09:10, 09:20) is bins 2 and 3; bin 4 starts exactly at the end and stays free
+    assert busy_bins(grid) == [2, 3]
+
+
+def test_partial_bins_count_as_busy():
+    grid = AvailabilityGrid.from_intervals({"a": [(at(9, 12), at(9, 21))]}, START, END)
+    assert busy_bins(grid) == [2, 3, 4]
+
+
+def test_overlapping_and_out_of_range_intervals():
+    intervals = {"a": [
+        (at(8), at(9, 5)),       # starts before the grid
+        (at(9, 30), at(9, 45)),
+        (at(9, 40), at(9, 50)),  # overlaps the previous one
+        (at(10, 55), at(12)),    # runs past the end
+        (at(13), at(14)),        # entirely after the end
+    ]}
+    grid = AvailabilityGrid.from_intervals(intervals, START, END)
+    assert busy_bins(grid) == [0, 6, 7, 8, 9, 23]
+
+
+def test_edges_in_other_timezones():
+    utc_start = at(9, 30).astimezone(timezone.utc)
+    grid = AvailabilityGrid.from_intervals({"a": [(utc_start, utc_start + timedelta(minutes=10))]}, START, END)
+    assert busy_bins(grid) == [6, 7]
+
+
+def test_all_free_and_quorum_free():
+    intervals = {
+        "a": [(at(9), at(9, 30))],
+        "b": [(at(9, 15), at(9, 45))],
+        "c": [],
+    }
+    grid = AvailabilityGrid.from_intervals(intervals, START, END)
+    assert grid.free_count()[[0, 3, 6, 9]].tolist() == [2, 1, 2, 3]
+    assert grid.all_free()[[0, 6, 9]].tolist() == [False, False, True]
+    assert grid.all_free(["a", "c"])[[0, 6]].tolist() == [False, True]
+    assert grid.quorum_free(2)[[0, 3, 6, 9]].tolist() == [True, False, True, True]
+    assert grid.quorum_free(3).sum() == grid.all_free().sum()
+
+
+def test_find_runs_with_step_and_limit():
+    grid = AvailabilityGrid.from_intervals({"a": [(at(9, 10), at(9, 50))]}, START, END)
+    free = grid.all_free()
+    assert grid.find_runs(free, 20) == [at(9, 50), at(9, 55)] + [at(10, m) for m in range(0, 45, 5)]
+    assert grid.find_runs(free, 20, step_minutes=30) == [at(10), at(10, 30)]
+    assert grid.find_runs(free, 20, step_minutes=30, limit=1) == [at(10)]
+    assert grid.find_runs(free, 180) == []
+
+
+def test_is_free():
+    grid = AvailabilityGrid.from_intervals({"a": [(at(9, 20), at(9, 50))]}, START, END)
+    assert grid.is_free("a", at(9), at(9, 20))
+    assert not grid.is_free("a", at(9, 10), at(9, 25))
+    assert grid.is_free("a", at(9, 50), at(10, 30))
+
+
+def test_working_hours():
+    grid = AvailabilityGrid.from_intervals({}, at(0), at(0, day=2))
+    hours = grid.working_hours(9, 18)
+    assert hours.sum() == 9 * 12
+    assert grid.bin_time(np.flatnonzero(hours)[0]) == at(9)
+    assert grid.bin_time(np.flatnonzero(hours)[-1]) == at(17, 55)
+
+
+def test_dst_start_day():
+    # Egypt moves its clocks from 00:00 to 01:00 on 2026-04-24, a 23-hour day
+    day_start = datetime(2026, 4, 24, tzinfo=CAIRO)
+    day_end = day_start + timedelta(days=1)
+    busy = (datetime(2026, 4, 24, 12, tzinfo=CAIRO), datetime(2026, 4, 24, 13, tzinfo=CAIRO))
+    grid = AvailabilityGrid.from_intervals({"primary": [busy]}, day_start, day_end)
+
+    assert grid.n_bins == 23 * 12
+    assert grid.bin_time(0).hour == 1
+    free = grid.all_free() & grid.working_hours(9, 18)
+    starts = [start.hour for start in grid.find_runs(free, 30, step_minutes=60)]
+    assert starts == [9, 10, 11, 13, 14, 15, 16, 17]
+    assert not grid.is_free("primary", busy[0], busy[1])
+    assert grid.is_free("primary", datetime(2026, 4, 24, 11, tzinfo=CAIRO), busy[0])
+
+
+def test_epoch_seconds_match_datetime_arithmetic():
+    # Around both 2026 changes in Cairo, including the skipped and the repeated hour
+    times = []
+    for day_start in (datetime(2026, 4, 23, 22, tzinfo=CAIRO), datetime(2026, 10, 29, 22, tzinfo=CAIRO)):
+        times += [day_start + timedelta(minutes=7 * i) for i in range(60)]
+    times.append(datetime(2026, 10, 29, 23, 30, fold=1, tzinfo=CAIRO))
+    times.append(datetime.fromisoformat("2026-04-24T00:30:00+03:00"))
+    times.append(datetime(2026, 4, 24, tzinfo=timezone.utc))
+    assert epoch_seconds(times).tolist() == [when.timestamp() for when in times]
+
+    naive = datetime(2026, 4, 24, 0, 30)
+    assert epoch_seconds([naive])[0] == naive.replace(tzinfo=timezone.utc).timestamp()
+
+
+def test_dst_end_day_working_hours():
+    # Clocks go back from 24:00 to 23:00 on 2026-10-29, so 2026-10-30 runs 25 hours from 2026-10-29 23:00
+    grid = AvailabilityGrid.from_intervals({}, datetime(2026, 10, 29, tzinfo=CAIRO), datetime(2026, 10, 31, tzinfo=CAIRO))
+    assert grid.n_bins == 49 * 12
+    hours = grid.working_hours(9, 18)
+    expected = [9 * 60 <= when.hour * 60 + when.minute < 18 * 60 for when in map(grid.bin_time, range(grid.n_bins))]
+    assert hours.tolist() == expected
+
+
+def test_find_runs_step_below_resolution():
+    grid = AvailabilityGrid.from_intervals({"a": [(at(9, 10), at(10, 50))]}, START, END)
+    # Steps round up to whole bins: 1 minute to one bin, 12 minutes to three
+    assert grid.find_runs(grid.all_free(), 10, step_minutes=1) == [at(9), at(10, 50)]
+    assert grid.find_runs(grid.all_free(), 10, step_minutes=12) == [at(9)]
@@ -0,0 +1,465 @@
+# test_chaos.py
+#
+# Chaos test for admission control and degraded mode: the Google Calendar
+# service is replaced with a local stub that injects latency.
+
+import contextlib
+import io
+import json
+import os
+import pickle
+import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ["CHECKPOINT_DB"] = os.path.join(tempfile.mkdtemp(), "chaos.sqlite")
+os.environ["OUTBOX_DB"] = os.path.join(tempfile.mkdtemp(), "outbox.sqlite")
+os.environ["OUTBOX_CALL_TIMEOUT"] = "0.5"
+os.environ["REQUEST_DEADLINE"] = "1"
+os.environ["MAX_IN_FLIGHT"] = "2"
+os.environ["CALENDAR_FAILURE_THRESHOLD"] = "3"
+os.environ["CALENDAR_RESET_TIMEOUT"] = "60"
+
+import httplib2
+import pytest
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+
+import agent
+import gcal
+import main
+from replies import format_datetime
+
+# dateparser is slow for its first few calls, keep that out of the timings
+with contextlib.redirect_stdout(io.StringIO()):
+    for _ in range(3):
+        agent.parse_message({"message": "book a call tomorrow at 3pm", "conversation_state": "initial"})
+
+
+class SlowCalendarStub:
+    """Stands in for the Calendar API service, sleeping `latency` seconds per call"""
+
+    def __init__(self):
+        self.latency = 0.0
+        self.error_status = None
+        self.insert_error_status = None
+        self.calls = 0
+        self.inserts = 0
+        self.busy = []
+        self.timeout = None
+
+    def freebusy(self):
+        return self
+
+    def events(self):
+        return self
+
+    def query(self, body):
+        self.error = self.error_status
+        self.response = {"calendars": {"primary": {"busy": self.busy}}}
+        return self
+
+    def insert(self, calendarId, body, sendUpdates):
+        self.inserts += 1
+        self.error = self.error_status or self.insert_error_status
+        self.response = {"htmlLink": "https://calendar.example.com/event"}
+        return self
+
+    def execute(self):
+        self.calls += 1
+        # Behave like httplib2: give up once the socket timeout is reached
+        if self.timeout is not None and self.latency > self.timeout:
+            time.sleep(self.timeout)
+            raise socket.timeout("timed out")
+        time.sleep(self.latency)
+        if self.error:
+            raise HttpError(httplib2.Response({"status": self.error}), b"calendar error")
+        return self.response
+
+
+@pytest.fixture
+def calendar(monkeypatch):
+    stub = SlowCalendarStub()
+
+    def get_calendar_service(timeout=None):
+        stub.timeout = timeout
+        return stub
+
+    monkeypatch.setattr(gcal, "get_calendar_service", get_calendar_service)
+    gcal.calendar_breaker.reset()
+    gcal._availability_cache.clear()
+    with agent.outbox.lock:
+        agent.outbox.conn.execute("DELETE FROM bookings")
+        agent.outbox.conn.commit()
+    return stub
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def chat(client, message, session_id):
+    started = time.perf_counter()
+    reply = client.post("/chat", json={"message": message, "session_id": session_id}).json()["reply"]
+    return reply, time.perf_counter() - started
+
+
+def test_slow_calendar_answers_within_deadline_and_queues_booking(calendar, client):
+    calendar.latency = 5
+
+    reply, elapsed = chat(client, "book a call tomorrow at 3pm", "slow")
+    assert elapsed < main.REQUEST_DEADLINE + 0.5
+    assert "email" in reply
+
+    reply, elapsed = chat(client, "me@example.com", "slow")
+    assert elapsed < main.REQUEST_DEADLINE + 0.5
+    assert "queued" in reply
+
+    booking_id = agent.persistent_app.get_state(agent.thread_config("slow")).values["booking_id"]
+    booking = agent.outbox.get(booking_id)
+    assert booking["status"] == "pending"
+    assert booking["degraded"]
+
+
+def wait_for_idle():
+    for _ in range(100):
+        if main.in_flight == 0:
+            return
+        time.sleep(0.05)
+    raise AssertionError("turn still running")
+
+
+def test_turn_past_deadline_books_nothing(calendar, client, monkeypatch):
+    chat(client, "book a call tomorrow at 3pm", "late")
+
+    # Something outside the calendar deadline (e.g. a stuck step) holds the turn up
+    def stuck(start_time, end_time):
+        time.sleep(main.REQUEST_DEADLINE + 0.2)
+        return True, False
+
+    monkeypatch.setattr(agent, "check_slot", stuck)
+    reply, elapsed = chat(client, "me@example.com", "late")
+    assert reply == main.render("timed_out")
+    assert elapsed < main.REQUEST_DEADLINE + 0.5
+
+    wait_for_idle()
+    assert agent.outbox.count("pending") == 0
+    state = agent.persistent_app.get_state(agent.thread_config("late")).values
+    assert state["conversation_state"] == "awaiting_email"
+    assert not state.get("booking_id")
+
+
+def test_circuit_opens_and_fails_fast(calendar, client):
+    calendar.latency = 5
+    for i in range(gcal.calendar_breaker.failure_threshold):
+        chat(client, "book a call tomorrow at 3pm", f"breaker-{i}")
+    assert gcal.calendar_breaker.is_open
+
+    calls = calendar.calls
+    reply, elapsed = chat(client, "book a call tomorrow at 4pm", "breaker-open")
+    assert calendar.calls == calls
+    assert elapsed < 0.5
+    assert "email" in reply
+
+
+def test_permanent_errors_do_not_open_circuit(calendar):
+    calendar.insert_error_status = 400
+    start = datetime.now().replace(microsecond=0) + timedelta(days=5)
+    for i in range(gcal.calendar_breaker.failure_threshold + 1):
+        agent.outbox.enqueue(start + timedelta(hours=i), start + timedelta(hours=i, minutes=30), "Chaos", "not-an-email")
+    assert agent.outbox.drain() == 0
+    assert agent.outbox.count("dead") >= gcal.calendar_breaker.failure_threshold + 1
+    assert not gcal.calendar_breaker.is_open
+
+    calendar.error_status = 503
+    for _ in range(gcal.calendar_breaker.failure_threshold):
+        with pytest.raises(gcal.CalendarUnavailable):
+            gcal.check_slot(start, start + timedelta(minutes=30))
+    assert gcal.calendar_breaker.is_open
+
+
+def test_cached_availability_used_when_calendar_is_slow(calendar):
+    start = datetime.now().replace(microsecond=0) + timedelta(days=1)
+    end = start + timedelta(minutes=30)
+    assert gcal.check_availability(start, end) is True
+
+    calendar.latency = 5
+    started = time.perf_counter()
+    with gcal.calendar_deadline(0.2):
+        assert gcal.check_availability(start, end) is True
+    assert time.perf_counter() - started < 0.5
+
+
+def test_stale_cached_availability_not_used(calendar, monkeypatch):
+    start = datetime.now().replace(microsecond=0) + timedelta(days=1)
+    end = start + timedelta(minutes=30)
+    assert gcal.check_slot(start, end) == (True, False)
+
+    calendar.latency = 5
+    monkeypatch.setattr(gcal, "AVAILABILITY_CACHE_TTL", 0)
+    with gcal.calendar_deadline(0.2), pytest.raises(gcal.CalendarUnavailable):
+        gcal.check_slot(start, end)
+
+
+def test_booking_on_cached_availability_is_verified(calendar):
+    with TestClient(main.app) as client:
+        chat(client, "book a call tomorrow at 3pm", "cached")
+        # Google goes down; the slot is still cached as free
+        calendar.latency = 5
+        reply, _ = chat(client, "me@example.com", "cached")
+        assert "queued" in reply
+
+        booking_id = agent.persistent_app.get_state(agent.thread_config("cached")).values["booking_id"]
+        assert agent.outbox.get(booking_id)["degraded"]
+        # Let the worker's attempt against the slow calendar finish before stopping it
+        for _ in range(50):
+            if agent.outbox.get(booking_id)["attempts"]:
+                break
+            time.sleep(0.05)
+
+    # Meanwhile someone else took the slot
+    calendar.latency = 0
+    start = agent.outbox.get(booking_id)["start_time"]
+    calendar.busy = [{"start": start.isoformat() + "+03:00", "end": (start + timedelta(minutes=30)).isoformat() + "+03:00"}]
+    make_due()
+    assert agent.outbox.drain() == 0
+    assert agent.outbox.get(booking_id)["status"] == "dead"
+    assert calendar.inserts == 0
+
+
+def test_admission_control_sheds_load(calendar, client):
+    calendar.latency = 5
+    replies = []
+
+    def send(i):
+        replies.append(chat(client, "book a call tomorrow at 3pm", f"load-{i}"))
+
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    shed = [elapsed for reply, elapsed in replies if reply == main.render("overloaded")]
+    assert len(shed) >= 6 - main.MAX_IN_FLIGHT
+    assert all(elapsed < 0.5 for elapsed in shed)
+    assert all(elapsed < main.REQUEST_DEADLINE + 0.5 for _, elapsed in replies)
+
+
+def make_due():
+    with agent.outbox.lock:
+        agent.outbox.conn.execute("UPDATE bookings SET next_attempt_at = 0")
+        agent.outbox.conn.commit()
+
+
+def test_queued_bookings_created_after_recovery(calendar):
+    calendar.latency = 5
+    start = datetime.now().replace(microsecond=0) + timedelta(days=2)
+    booking_id = agent.outbox.enqueue(start, start + timedelta(minutes=30), "Chaos", "me@example.com")
+    assert agent.outbox.drain() == 0
+    assert agent.outbox.get(booking_id)["attempts"] == 1
+
+    calendar.latency = 0
+    make_due()
+    assert agent.outbox.drain() == 1
+    booking = agent.outbox.get(booking_id)
+    assert booking["status"] == "done"
+    assert booking["html_link"] == "https://calendar.example.com/event"
+
+
+def test_degraded_booking_dead_lettered_when_slot_taken(calendar):
+    start = datetime.now().replace(microsecond=0) + timedelta(days=4)
+    end = start + timedelta(minutes=30)
+    booking_id = agent.outbox.enqueue(start, end, "Chaos", "me@example.com", degraded=True)
+
+    calendar.busy = [{"start": start.isoformat() + "+03:00", "end": end.isoformat() + "+03:00"}]
+    assert agent.outbox.drain() == 0
+    booking = agent.outbox.get(booking_id)
+    assert booking["status"] == "dead"
+    assert "taken" in booking["last_error"]
+    assert calendar.inserts == 0
+
+
+def test_degraded_booking_created_when_slot_still_free(calendar):
+    start = datetime.now().replace(microsecond=0) + timedelta(days=4)
+    booking_id = agent.outbox.enqueue(start, start + timedelta(minutes=30), "Chaos", "me@example.com", degraded=True)
+
+    assert agent.outbox.drain() == 1
+    assert agent.outbox.get(booking_id)["status"] == "done"
+    assert calendar.inserts == 1
+
+
+def test_permanent_errors_are_dead_lettered(calendar):
+    calendar.error_status = 403
+    start = datetime.now().replace(microsecond=0) + timedelta(days=3)
+    booking_id = agent.outbox.enqueue(start, start + timedelta(minutes=30), "Chaos", "me@example.com")
+    assert agent.outbox.drain() == 0
+    assert agent.outbox.get(booking_id)["status"] == "dead"
+    assert agent.outbox.count("pending") == 0
+
+
+def test_worker_records_link_on_session(calendar, client):
+    reply, _ = chat(client, "book a call tomorrow at 3pm", "confirmed")
+    reply, elapsed = chat(client, "me@example.com", "confirmed")
+    assert "invite" in reply
+    assert "booked" not in reply
+
+    config = agent.thread_config("confirmed")
+    for _ in range(50):
+        if agent.persistent_app.get_state(config).values.get("booking_link"):
+            break
+        time.sleep(0.05)
+    state = agent.persistent_app.get_state(config).values
+    assert state["booking_link"] == "https://calendar.example.com/event"
+    assert state["booking_status"] == "confirmed"
+
+
+def fail_booking(calendar, client, session_id):
+    """Book through the chat and wait until the outbox reports the booking failed"""
+    chat(client, "book a call tomorrow at 3pm", session_id)
+    # Freebusy still works, the insert is refused for good
+    calendar.insert_error_status = 403
+    chat(client, "me@example.com", session_id)
+
+    config = agent.thread_config(session_id)
+    for _ in range(50):
+        if agent.persistent_app.get_state(config).values.get("booking_status") == "failed":
+            break
+        time.sleep(0.05)
+    values = agent.persistent_app.get_state(config).values
+    assert values["booking_status"] == "failed"
+    return values
+
+
+def test_failed_booking_reported_on_next_turn(calendar, client):
+    fail_booking(calendar, client, "rejected")
+
+    reply, _ = chat(client, "hi", "rejected")
+    assert "not booked" in reply
+    assert reply.endswith(main.render("greeting"))
+
+    reply, _ = chat(client, "hi", "rejected")
+    assert reply == main.render("greeting")
+
+
+def test_failed_booking_reported_without_outbox_row(calendar, client):
+    values = fail_booking(calendar, client, "purged")
+    with agent.outbox.lock:
+        agent.outbox.conn.execute("DELETE FROM bookings")
+        agent.outbox.conn.commit()
+
+    reply, _ = chat(client, "hi", "purged")
+    assert "not booked" in reply
+    assert format_datetime(values["proposed_start"]) in reply
+
+    reply, _ = chat(client, "hi", "purged")
+    assert reply == main.render("greeting")
+
+
+def test_stream_sends_progress_before_slow_reply(calendar, client):
+    calendar.latency = 5
+    with client.stream("POST", "/chat/stream", json={"message": "book a call tomorrow at 3pm", "session_id": "stream"}) as response:
+        events = [json.loads(line) for line in response.iter_lines() if line]
+    assert events[0] == {"progress": main.render("working")}
+    assert "email" in events[-1]["reply"]
+
+
+@pytest.mark.parametrize("content", [b"{not json", b"[1, 2]"])
+def test_stream_reports_malformed_body(client, content):
+    response = client.post("/chat/stream", content=content, headers={"Content-Type": "application/json"})
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.iter_lines() if line]
+    assert len(events) == 1
+    assert events[0]["reply"].startswith("⚠️ Backend error:")
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """Google endpoints stand-in: answers every request after `latency` seconds"""
+
+    latency = 3.0
+
+    def do_GET(self):
+        self.answer()
+
+    def do_POST(self):
+        self.answer()
+
+    def answer(self):
+        time.sleep(self.latency)
+        body = json.dumps({"calendars": {"primary": {"busy": []}}, "access_token": "t", "expires_in": 3600}).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass  # the client already gave up
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def google_stub(tmp_path, monkeypatch):
+    """Real get_calendar_service against a local server that injects latency"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.chdir(tmp_path)
+    gcal.calendar_breaker.reset()
+
+    def write_token(expired):
+        creds = Credentials(
+            token="token",
+            refresh_token="refresh",
+            token_uri=f"http://127.0.0.1:{server.server_port}/token",
+            client_id="client",
+            client_secret="secret",
+            expiry=datetime.utcnow() + timedelta(hours=-1 if expired else 1),
+        )
+        with open("token.pickle", "wb") as token:
+            pickle.dump(creds, token)
+
+    server.write_token = write_token
+    server.url = f"http://127.0.0.1:{server.server_port}/freebusy"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_calendar_transport_bounded_by_deadline(google_stub):
+    google_stub.write_token(expired=False)
+
+    def query(timeout):
+        request = gcal.get_calendar_service(timeout).freebusy().query(body={"items": [{"id": "primary"}]})
+        assert request.http.http.timeout == pytest.approx(timeout, abs=0.05)
+        request.uri = google_stub.url
+        return request.execute()
+
+    started = time.perf_counter()
+    with gcal.calendar_deadline(0.5), pytest.raises(gcal.CalendarUnavailable):
+        gcal.call_calendar(query)
+    assert time.perf_counter() - started < SlowHandler.latency - 1
+
+    SlowHandler.latency = 0
+    try:
+        with gcal.calendar_deadline(0.5):
+            assert gcal.call_calendar(query)["calendars"]["primary"]["busy"] == []
+    finally:
+        SlowHandler.latency = 3.0
+
+
+def test_credential_refresh_bounded_by_deadline(google_stub):
+    google_stub.write_token(expired=True)
+
+    started = time.perf_counter()
+    with pytest.raises(RuntimeError, match="refresh"):
+        gcal.get_calendar_service(0.5)
+    assert time.perf_counter() - started < SlowHandler.latency - 1
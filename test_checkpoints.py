@@ -0,0 +1,120 @@
+# test_checkpoints.py
+#
+# Per-turn commit/rollback of conversation checkpoints and compaction.
+
+import contextlib
+import io
+import os
+import tempfile
+import threading
+
+os.environ["CHECKPOINT_DB"] = os.path.join(tempfile.mkdtemp(), "checkpoints.sqlite")
+os.environ.setdefault("OUTBOX_DB", os.path.join(tempfile.mkdtemp(), "outbox.sqlite"))
+
+import pytest
+
+import agent
+import gcal
+
+
+class MalformedCalendarStub:
+    """Answers freebusy without the 'primary' calendar once `release` is set"""
+
+    def __init__(self):
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def freebusy(self):
+        return self
+
+    def query(self, body):
+        return self
+
+    def execute(self):
+        self.entered.set()
+        self.release.wait(5)
+        return {"calendars": {}}
+
+
+@pytest.fixture
+def calendar(monkeypatch):
+    stub = MalformedCalendarStub()
+    monkeypatch.setattr(gcal, "get_calendar_service", lambda timeout=None: stub)
+    gcal.calendar_breaker.reset()
+    gcal._availability_cache.clear()
+    return stub
+
+
+def snapshot(session_id):
+    state = agent.persistent_app.get_state(agent.thread_config(session_id))
+    return state.values, state.next
+
+
+def test_failed_turn_is_rolled_back(calendar):
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.handle_message("hi", "rollback")
+    before = snapshot("rollback")
+
+    with pytest.raises(KeyError), contextlib.redirect_stdout(io.StringIO()):
+        calendar.release.set()
+        agent.handle_message("book a call tomorrow at 3pm", "rollback")
+
+    assert snapshot("rollback") == before
+    assert before[1] == ()
+
+
+def test_other_turn_does_not_commit_half_run_turn(calendar):
+    errors = []
+
+    def failing_turn():
+        try:
+            agent.handle_message("book a call tomorrow at 3pm", "half-run")
+        except KeyError as e:
+            errors.append(e)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        thread = threading.Thread(target=failing_turn)
+        thread.start()
+        assert calendar.entered.wait(30)
+
+        # Another session finishes a turn while the first is mid-graph
+        reply = agent.handle_message("hi", "bystander")
+        calendar.release.set()
+        thread.join()
+
+    assert errors
+    assert reply == agent.render("greeting")
+    assert snapshot("half-run") == ({}, ())
+    assert snapshot("bystander")[0]["conversation_state"] == "initial"
+
+
+def count_checkpoints(thread_id):
+    with agent.checkpointer.lock:
+        return agent.checkpointer.conn.execute(
+            "SELECT COUNT(*) FROM checkpoints WHERE thread_id = ?", (thread_id,)
+        ).fetchone()[0]
+
+
+def test_compact_keeps_newest_checkpoints():
+    config = agent.thread_config("compact")
+    for i in range(6):
+        agent.persistent_app.update_state(config, {"message": f"turn {i}"}, as_node="parse")
+    assert count_checkpoints("compact") == 6
+
+    removed = agent.checkpointer.compact(keep=2)
+
+    assert removed >= 4
+    assert count_checkpoints("compact") == 2
+    assert agent.persistent_app.get_state(config).values["message"] == "turn 5"
+    history = list(agent.persistent_app.get_state_history(config))
+    assert [state.values["message"] for state in history] == ["turn 5", "turn 4"]
+    with agent.checkpointer.lock:
+        orphaned = agent.checkpointer.conn.execute(
+            """
+            SELECT COUNT(*) FROM writes
+            WHERE (thread_id, checkpoint_ns, checkpoint_id) NOT IN (
+                SELECT thread_id, checkpoint_ns, checkpoint_id FROM checkpoints
+            )
+            """
+        ).fetchone()[0]
+    assert orphaned == 0
@@ -0,0 +1,63 @@
+# test_fast_path.py
+#
+# The fast path must answer exactly like the full graph, or not at all.
+
+import contextlib
+import io
+import os
+import tempfile
+from datetime import datetime
+
+os.environ.setdefault("CHECKPOINT_DB", os.path.join(tempfile.mkdtemp(), "checkpoints.sqlite"))
+os.environ.setdefault("OUTBOX_DB", os.path.join(tempfile.mkdtemp(), "outbox.sqlite"))
+
+import pytest
+
+import agent
+
+SLOTS = [datetime(2025, 7, 1, 9), datetime(2025, 7, 1, 10)]
+
+# Messages with no booking intent, with casing and spacing as users type them
+TRIVIAL_MESSAGES = (
+    sorted(agent.GREETINGS) + ["  Hello ", "HI"]
+    + sorted(agent.REJECTIONS) + ["No thanks", "none of those"]
+    + ["thanks", "thank you!", "what can you do?", "who are you"]
+)
+
+
+def previous_state(conversation_state, message):
+    return {
+        "message": message,
+        "conversation_state": conversation_state,
+        "suggested_slots": list(SLOTS),
+        "session_id": "fast-path",
+    }
+
+
+def quietly(fn, state):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(state)
+
+
+@pytest.mark.parametrize("conversation_state", agent.FAST_PATH_STATES)
+@pytest.mark.parametrize("message", TRIVIAL_MESSAGES)
+def test_fast_path_matches_graph(conversation_state, message):
+    state = previous_state(conversation_state, message)
+    graph = quietly(agent.app.invoke, dict(state))
+    fast = quietly(agent.fast_path, dict(state))
+
+    assert fast is not None
+    assert fast["reply"] == graph["reply"]
+    assert fast["conversation_state"] == graph["conversation_state"]
+    assert fast.get("suggested_slots") == graph.get("suggested_slots")
+
+
+@pytest.mark.parametrize("conversation_state", agent.FAST_PATH_STATES)
+@pytest.mark.parametrize("message", ["book a call tomorrow at 3pm", "friday at 10am", "schedule a meeting"])
+def test_booking_turns_skip_fast_path(conversation_state, message):
+    assert quietly(agent.fast_path, previous_state(conversation_state, message)) is None
+
+
+@pytest.mark.parametrize("message", ["hi", "no", "thanks", "me@example.com"])
+def test_awaiting_email_skips_fast_path(message):
+    assert quietly(agent.fast_path, previous_state("awaiting_email", message)) is None
@@ -0,0 +1,51 @@
+# test_replies.py
+
+from datetime import datetime
+
+import pytest
+
+from replies import TEMPLATES, format_slots, render, suggestion_reply
+
+DAY = datetime(2025, 7, 1).date()
+SLOTS = (datetime(2025, 7, 1, 9), datetime(2025, 7, 1, 10), datetime(2025, 7, 1, 14, 30))
+
+
+def test_static_template_returned_as_is():
+    assert render("greeting") == TEMPLATES["en"]["greeting"]
+
+
+def test_placeholders_are_filled():
+    reply = render("booking_queued", when="2025-07-01 09:00", email="me@example.com")
+    assert "2025-07-01 09:00" in reply
+    assert "me@example.com" in reply
+    assert "{" not in reply
+
+
+def test_missing_field_raises():
+    with pytest.raises(KeyError):
+        render("booking_queued")
+    with pytest.raises(KeyError):
+        render("booking_queued", when="2025-07-01 09:00")
+
+
+def test_unknown_locale_falls_back_to_english():
+    assert render("greeting", "xx") == TEMPLATES["en"]["greeting"]
+
+
+def test_format_slots():
+    assert format_slots(DAY, SLOTS) == "09:00, 10:00, 14:30"
+    assert format_slots(DAY, ()) == ""
+
+
+def test_suggestion_reply():
+    assert suggestion_reply(DAY, SLOTS) == render(
+        "suggest", date=DAY, times="09:00, 10:00, 14:30"
+    )
+    assert suggestion_reply(DAY, ()) == render("no_slots", date=DAY)
+
+
+def test_suggestion_reply_is_memoized():
+    suggestion_reply.cache_clear()
+    suggestion_reply(DAY, SLOTS)
+    suggestion_reply(DAY, SLOTS)
+    assert suggestion_reply.cache_info().hits == 1